@@ -1,8 +1,12 @@
 import numpy as np
 import polars as pl
 
+from instrument import timed
+from data_utils import float_values
+
+@timed("select")
 def analyze_series(data):
-    values = data.select("value").drop_nulls().to_numpy().flatten()
+    values = data.select(float_values(data)).drop_nulls().to_numpy().flatten()
     if len(values) < 3:
         return 'linear'
     
@@ -29,4 +33,45 @@ def analyze_series(data):
 
 def select_best_method(data):
     method = analyze_series(data)
-    return {'method': method, 'confidence': 'auto'}
\ No newline at end of file
+    return {'method': method, 'confidence': 'auto'}
+
+@timed("select_batch")
+def select_best_methods(data):
+    """Выбор метода сразу для всех рядов длинного фрейма id/date/value по тем же правилам, что analyze_series.
+
+    Все МНК-подгонки считаются в закрытом виде групповыми агрегатами Polars, без цикла по рядам.
+    """
+    y = float_values(data)
+    x = pl.int_range(pl.len()).cast(pl.Float64)
+    xc = x - x.mean()
+    # Центрированный квадрат ортогонален 1 и xc, поэтому вклад квадратичного члена считается отдельно
+    x2c = xc ** 2 - (xc ** 2).mean()
+    yc = y - y.mean()
+
+    features = (
+        data.drop_nulls("value")
+        .sort(["id", "date"])
+        .group_by("id", maintain_order=True)
+        .agg([
+            pl.len().alias("n"),
+            (y > 0).all().alias("positive"),
+            ((xc * y.log()).sum() / (xc ** 2).sum()).alias("log_slope"),
+            pl.when(y.mean() > 0).then(y.diff().std(ddof=0) / y.mean()).otherwise(0.0).alias("volatility"),
+            (yc ** 2).sum().alias("total_error"),
+            ((xc * yc).sum() ** 2 / (xc ** 2).sum()).alias("linear_gain"),
+            ((x2c * yc).sum() ** 2 / (x2c ** 2).sum()).alias("poly_gain")
+        ])
+        .with_columns((pl.col("total_error") - pl.col("linear_gain")).alias("linear_error"))
+    )
+
+    return features.select([
+        "id",
+        pl.when(pl.col("n") < 3).then(pl.lit("linear"))
+        .when(pl.col("positive") & (pl.col("log_slope") > 0.1)).then(pl.lit("log"))
+        .when(pl.col("volatility") > 0.3).then(pl.lit("spline"))
+        # Остаток точной прямой ~1e-20 от шума округления не считаем нелинейностью
+        .when((pl.col("linear_error") > pl.col("total_error") * 1e-10)
+              & (pl.col("poly_gain") / pl.col("linear_error") > 0.2)).then(pl.lit("polynomial"))
+        .otherwise(pl.lit("linear"))
+        .alias("method")
+    ])
@@ -0,0 +1,261 @@
+import zlib
+
+import numpy as np
+import polars as pl
+
+from instrument import timed
+from data_utils import float_values
+from methods.local import moment_polyfit
+
+BACKTEST_METHODS = ['linear', 'polynomial', 'spline', 'log']
+
+def prepare(data):
+    """Длинный фрейм id/date/value (дневные строки, сортировка по id и дате) -> массивы для пакетного расчёта"""
+    data = data.drop_nulls("value")
+    ids = data["id"].cast(pl.String)
+    days = data["date"].dt.date().cast(pl.Int32).to_numpy().astype(np.int64)
+    series = ids.rle_id().to_numpy()
+    starts = np.flatnonzero(np.r_[True, series[1:] != series[:-1]])
+    return {
+        'ids': ids.gather(starts),
+        'series': series,
+        'days': days,
+        'values': data.select(float_values(data)).to_series().to_numpy()
+    }
+
+def gap_lengths(arrays):
+    """Длины реальных пропусков (в днях) по рядам: массив длин по порядку рядов, смещения и число пропусков ряда, средняя длина"""
+    series, days = arrays['series'], arrays['days']
+    same = series[1:] == series[:-1]
+    lengths = np.diff(days) - 1
+    real = same & (lengths > 0)
+    gap_series, gap_len = series[:-1][real], lengths[real]
+    counts = np.bincount(gap_series, minlength=len(arrays['ids']))
+    mean_len = np.bincount(gap_series, gap_len, len(arrays['ids'])) / np.maximum(counts, 1)
+    return gap_len, np.r_[0, np.cumsum(counts)[:-1]], counts, np.where(counts > 0, mean_len, 1.0)
+
+def _mix(*parts):
+    """splitmix64 от набора uint64-массивов -> равномерные числа [0, 1)"""
+    h = np.zeros(np.broadcast_shapes(*(np.shape(p) for p in parts)), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for part in parts:
+            h = h ^ np.asarray(part, dtype=np.uint64)
+            h = h + np.uint64(0x9E3779B97F4A7C15)
+            h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            h = h ^ (h >> np.uint64(31))
+    return (h >> np.uint64(11)).astype(np.float64) / 2.0 ** 53
+
+def holdout_masks(arrays, n_masks=3, holdout=0.1, seed=0):
+    """Маски скрытых точек: серии подряд идущих дней, длины берутся из реальных пропусков того же ряда.
+
+    Возвращает bool-массив (n_masks, строки). Первая и последняя точки ряда не скрываются,
+    поэтому скрытые дни всегда внутри обучающего диапазона, как и настоящие пропуски.
+    Случайные числа - хэш (seed, crc32(id), день, маска): маска ряда не зависит от того, какие ещё ряды в вызове.
+    """
+    series, days = arrays['series'], arrays['days']
+    id_hash = np.array([zlib.crc32(str(i).encode()) for i in arrays['ids']], dtype=np.uint64)[series]
+    n = len(series)
+    gap_len, gap_offsets, gap_counts, mean_len = gap_lengths(arrays)
+
+    # Серия начинается в случайной точке; вероятность подобрана так, чтобы скрыть ~holdout точек
+    start_rate = holdout / mean_len[series]
+    first = np.r_[True, series[1:] != series[:-1]]
+    last = np.r_[series[1:] != series[:-1], True]
+    key = series * (days.max() + 2) + days
+    series_end = np.flatnonzero(last) + 1
+
+    masks = np.zeros((n_masks, n), dtype=bool)
+    for m in range(n_masks):
+        starts = np.flatnonzero((_mix(seed, id_hash, days, m, 0) < start_rate) & ~last)
+        counts = gap_counts[series[starts]]
+        draws = _mix(seed, id_hash[starts], days[starts], m, 1)
+        picks = gap_offsets[series[starts]] + (draws * counts).astype(np.int64)
+        lengths = np.where(counts > 0, gap_len[np.minimum(picks, len(gap_len) - 1)] if len(gap_len) else 1, 1)
+        # Скрываем точки с датой в [день старта, день старта + длина): разностный массив по позициям
+        # Серия не выходит за последнюю точку своего ряда, даже если длина пропуска больше разноса ключей
+        ends = np.minimum(np.searchsorted(key, key[starts] + lengths), series_end[series[starts]])
+        coverage = np.zeros(n + 1, dtype=np.int64)
+        np.add.at(coverage, starts, 1)
+        np.add.at(coverage, ends, -1)
+        masks[m] = (np.cumsum(coverage[:-1]) > 0) & ~first & ~last
+    return masks
+
+def _groups(arrays, masks):
+    """Все (маска, ряд) одним набором: группа g = маска * число рядов + ряд, x разнесены по группам без пересечений"""
+    n_masks, n = masks.shape
+    n_series = len(arrays['ids'])
+    group = (np.arange(n_masks)[:, None] * n_series + arrays['series'][None, :]).ravel()
+    x = np.tile(arrays['days'], n_masks).astype(float)
+    # Сдвиг на группу: np.interp и searchsorted по одному массиву не перескакивают между рядами
+    x_global = group * (arrays['days'].max() + 2.0) + x
+    return group, x, x_global, np.tile(arrays['values'], n_masks), masks.ravel()
+
+def fill_linear(group, x, x_global, y, hidden):
+    train = ~hidden
+    return np.interp(x_global[hidden], x_global[train], y[train])
+
+def fill_log(group, x, x_global, y, hidden):
+    # Тот же сдвиг на 1, что в methods/log.fill, если в обучающих точках ряда есть значения <= 0
+    train = ~hidden
+    shift = np.bincount(group[train], y[train] <= 0, minlength=group.max() + 1) > 0
+    shifted = y + shift[group]
+    # Значения <= -1 и после сдвига не положительны: methods/log не заполнит пропуски такого ряда, поэтому группа
+    # целиком NaN (coverage < 1, метод не выбирается). Скрытые точки тоже считаются - настоящее заполнение их видит
+    invalid = np.bincount(group, y + 1 <= 0, minlength=len(shift)) > 0
+    usable = train & ~invalid[group]
+    if not usable.any():
+        return np.full(hidden.sum(), np.nan)
+    filled = np.exp(np.interp(x_global[hidden], x_global[usable], np.log(shifted[usable])))
+    filled = np.where(invalid[group[hidden]], np.nan, filled)
+    return np.where(shift[group[hidden]], np.clip(filled - 1, 0, None), filled)
+
+def fill_polynomial(group, x, x_global, y, hidden, order=2):
+    """Глобальный полином order по обучающим точкам каждой группы: moment_polyfit с суммами по группам"""
+    train = ~hidden
+    n_groups = group.max() + 1
+    g, t, yt = group[train], x[train], y[train]
+    # Центрирование и масштаб по группе только для обусловленности, сам полином тот же, что у np.polyfit
+    count = np.bincount(g, minlength=n_groups)
+    center = np.bincount(g, t, n_groups) / np.maximum(count, 1)
+    scale = np.maximum(np.bincount(g, np.abs(t - center[g]), n_groups) / np.maximum(count, 1), 1.0)
+    t = (t - center[g]) / scale[g]
+
+    # Как в methods/polynomial.fill: подгонка только при числе точек больше order + 1, иначе пропуск не заполняется
+    coef = moment_polyfit(
+        t, yt, np.ones_like(t), order, lambda v: np.bincount(g, v, n_groups), fitted=count > order + 1
+    )
+
+    th = (x[hidden] - center[group[hidden]]) / scale[group[hidden]]
+    c = coef[group[hidden]]
+    filled = np.zeros(len(th))
+    for k in range(order, -1, -1):
+        filled = filled * th + c[:, k]
+    return np.clip(filled, 0, None)
+
+def fill_spline(group, x, x_global, y, hidden):
+    """Интерполяционный кубический сплайн (not-a-knot, как UnivariateSpline(s=0, k=3)) сразу для всех групп.
+
+    Наклоны во всех узлах всех групп - одна трёхдиагональная система (solve_banded), группы в ней не связаны.
+    Группы меньше чем из 4 точек заполняются линейно, как в methods/spline.fill.
+    """
+    from scipy.linalg import solve_banded
+
+    train = ~hidden
+    g, xt, yt, xg = group[train], x[train], y[train], x_global[train]
+    n = len(xt)
+    first = np.r_[True, g[1:] != g[:-1]]
+    last = np.r_[g[1:] != g[:-1], True]
+    size = np.bincount(g, minlength=group.max() + 1)[g]
+
+    # Отрезки между соседними узлами одной группы (на стыке групп - фиктивные, обнуляются ниже)
+    dx = np.r_[np.diff(xt), 1.0]
+    dx[last] = 1.0
+    slope = np.r_[np.diff(yt), 0.0] / dx
+    slope[last] = 0.0
+    dx_prev, slope_prev = np.r_[1.0, dx[:-1]], np.r_[0.0, slope[:-1]]
+
+    # Внутренние узлы: dx_i s_{i-1} + 2(dx_{i-1} + dx_i) s_i + dx_{i-1} s_{i+1} = 3(dx_i m_{i-1} + dx_{i-1} m_i)
+    diag = 2 * (dx_prev + dx)
+    upper = dx_prev.copy()
+    lower = dx.copy()
+    b = 3 * (dx * slope_prev + dx_prev * slope)
+
+    # Краевые условия not-a-knot (третья производная непрерывна во втором и предпоследнем узле)
+    i = np.flatnonzero(first & (size >= 4))
+    d = xt[i + 2] - xt[i]
+    diag[i], upper[i] = dx[i + 1], d
+    b[i] = ((dx[i] + 2 * d) * dx[i + 1] * slope[i] + dx[i] ** 2 * slope[i + 1]) / d
+    j = np.flatnonzero(last & (size >= 4))
+    d = xt[j] - xt[j - 2]
+    diag[j], lower[j] = dx[j - 2], d
+    b[j] = (dx[j - 1] ** 2 * slope[j - 2] + (2 * d + dx[j - 1]) * dx[j - 2] * slope[j - 1]) / d
+    # Маленькие группы - тривиальные строки (наклоны не используются)
+    small = size < 4
+    diag[small], upper[small], lower[small], b[small] = 1.0, 0.0, 0.0, 0.0
+
+    # Связи через границу групп убираем
+    lower[first] = 0.0
+    upper[last] = 0.0
+    banded = np.zeros((3, n))
+    banded[0, 1:] = upper[:-1]
+    banded[1] = diag
+    banded[2, :-1] = lower[1:]
+    slopes = solve_banded((1, 1), banded, b)
+
+    # Эрмитова кубика на отрезке, куда попал скрытый день
+    xh = x_global[hidden]
+    k = np.searchsorted(xg, xh) - 1
+    h = xg[k + 1] - xg[k]
+    t = (xh - xg[k]) / h
+    filled = (
+        (2 * t ** 3 - 3 * t ** 2 + 1) * yt[k] + (t ** 3 - 2 * t ** 2 + t) * h * slopes[k]
+        + (-2 * t ** 3 + 3 * t ** 2) * yt[k + 1] + (t ** 3 - t ** 2) * h * slopes[k + 1]
+    )
+    linear = np.interp(xh, xg, yt)
+    return np.where(size[k] >= 4, np.clip(filled, 0, None), linear)
+
+FILLS = {
+    'linear': fill_linear,
+    'polynomial': fill_polynomial,
+    'spline': fill_spline,
+    'log': fill_log
+}
+
+@timed("backtest", rows=lambda scores: scores.height)
+def backtest(data, methods=None, n_masks=3, holdout=0.1, seed=0):
+    """Ошибка каждого метода на скрытых известных точках: по строке на (id, method).
+
+    data - длинный фрейм id/date/value с одной точкой за день (например index['data']). Методы считаются
+    сразу по всем рядам и маскам. mae/rmse в единицах ряда, wape = sum|ошибка| / sum|факт|,
+    coverage - доля скрытых точек, которые метод вообще заполнил.
+    """
+    arrays = prepare(data)
+    masks = holdout_masks(arrays, n_masks, holdout, seed)
+    group, x, x_global, y, hidden = _groups(arrays, masks)
+    ids = arrays['ids'].gather(group[hidden] % len(arrays['ids']))
+
+    scores = []
+    for method_name in methods or BACKTEST_METHODS:
+        predicted = FILLS[method_name](group, x, x_global, y, hidden)
+        scores.append(pl.DataFrame({
+            "id": ids, "method": method_name, "actual": y[hidden], "predicted": predicted
+        }))
+
+    error = pl.col("predicted") - pl.col("actual")
+    filled = pl.col("predicted").is_not_nan()
+    return (
+        pl.concat(scores)
+        .group_by(["id", "method"], maintain_order=True)
+        .agg([
+            pl.len().alias("hidden_points"),
+            (filled.sum() / pl.len()).alias("coverage"),
+            error.filter(filled).abs().mean().alias("mae"),
+            (error.filter(filled) ** 2).mean().sqrt().alias("rmse"),
+            (error.filter(filled).abs().sum() / pl.col("actual").filter(filled).abs().sum()).alias("wape")
+        ])
+        .sort(["id", "method"])
+    )
+
+def choose_methods(scores):
+    """Лучший метод ряда по измеренной ошибке (mae) среди заполнивших все скрытые точки.
+
+    confidence = 1 - mae лучшего / mae второго: 0 - методы неразличимы, ближе к 1 - явный победитель.
+    """
+    ranked = (
+        scores.filter(pl.col("coverage") == 1)
+        .sort(["id", "mae", "method"])
+        .group_by("id", maintain_order=True)
+        .agg([
+            pl.col("method").first(),
+            pl.col("mae").first(),
+            pl.col("wape").first(),
+            pl.col("mae").slice(1, 1).first().alias("runner_up_mae")
+        ])
+    )
+    return ranked.with_columns(
+        pl.when(pl.col("runner_up_mae") > 0)
+        .then(1 - pl.col("mae") / pl.col("runner_up_mae"))
+        .otherwise(0.0)
+        .alias("confidence")
+    ).drop("runner_up_mae")
@@ -0,0 +1,143 @@
+# %% TSDS - бенчмарк конвейера на синтетических данных
+# python benchmark.py --scales 100x365 1000x365 --out bench.json
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+
+def generate_raw(path, n_series=100, span_days=365, gap_density=0.3, dup_rate=0.2, malformed_rate=0.01, seed=0):
+    """Пишет синтетический collected.csv в формате сборщика: row_number,date,id,value без заголовка.
+
+    gap_density - доля пропущенных дней, dup_rate - доля дней с повторной точкой внутри дня,
+    malformed_rate - доля строк с битой датой.
+    """
+    rng = np.random.default_rng(seed)
+    ids = np.repeat(np.arange(n_series) + 100000000, span_days)
+    days = np.tile(np.arange(span_days), n_series)
+
+    # Разные формы рядов: линейный тренд, экспонента, шум вокруг уровня
+    kind = ids % 3
+    base = rng.uniform(50, 500, n_series)[ids - 100000000]
+    values = np.where(
+        kind == 0, base + 2 * days,
+        np.where(kind == 1, base * 1.01 ** days, base * (1 + rng.random(len(days))))
+    )
+
+    keep = rng.random(len(days)) >= gap_density
+    ids, days, values = ids[keep], days[keep], values[keep]
+
+    # Повторные замеры за тот же день, несколькими часами позже
+    dup = rng.random(len(days)) < dup_rate
+    hours = np.concatenate([np.full(len(days), 9), np.full(dup.sum(), 15)])
+    ids = np.concatenate([ids, ids[dup]])
+    days = np.concatenate([days, days[dup]])
+    values = np.concatenate([values, values[dup] * rng.uniform(0.95, 1.05, dup.sum())])
+
+    df = (
+        pl.DataFrame({"id": ids.astype(str), "day": days, "hour": hours, "value": values.round(1)})
+        .sort(["day", "hour", "id"])
+        .with_columns(
+            (pl.lit(datetime(2024, 1, 1)) + pl.duration(days=pl.col("day"), hours=pl.col("hour")))
+            .dt.strftime("%Y-%m-%d %H:%M:%S+03:00").alias("date")
+        )
+    )
+    malformed = pl.Series(rng.random(df.height) < malformed_rate)
+    df = df.with_columns(pl.when(malformed).then(pl.lit("n/a")).otherwise(pl.col("date")).alias("date"))
+
+    df.with_row_index("row_number").select(["row_number", "date", "id", "value"]).write_csv(path, include_header=False)
+    return df.height
+
+def peak_rss_mb():
+    # ru_maxrss в Linux - килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def timed(records, scale, stage, func, items=1):
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    if callable(items):
+        items = items(result)
+    records.append({
+        'scale': scale,
+        'stage': stage,
+        'seconds': round(seconds, 6),
+        'items': items,
+        'items_per_sec': round(items / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    })
+    return result
+
+def run_scale(n_series, span_days, sample=50, **generator_options):
+    """Один масштаб: генерация, загрузка, поиск рядов, автовыбор и ядра методов"""
+    from data_utils import get_top_series, get_series_data, build_series_index, lookup_series
+    from auto_select import analyze_series, select_best_methods
+    from methods import KERNELS, build_grid
+
+    scale = f'{n_series}x{span_days}'
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'collected.csv')
+        rows = timed(
+            records, scale, 'generate', lambda: generate_raw(path, n_series, span_days, **generator_options),
+            items=lambda rows: rows
+        )
+
+        df_clean, _ = timed(records, scale, 'ingest', lambda: get_top_series(path), rows)
+        index = timed(records, scale, 'build_index', lambda: build_series_index(df_clean), df_clean.height)
+
+    ids = list(index['offsets'])[:sample]
+    timed(records, scale, 'lookup_scan', lambda: [get_series_data(df_clean, i) for i in ids], len(ids))
+    series = timed(records, scale, 'lookup_index', lambda: [lookup_series(index, i) for i in ids], len(ids))
+
+    timed(records, scale, 'select_loop', lambda: [analyze_series(s) for s in series], len(ids))
+    timed(records, scale, 'select_batch', lambda: select_best_methods(index['data']), len(index['offsets']))
+
+    grids = timed(records, scale, 'build_grid', lambda: [build_grid(s) for s in series], len(ids))
+    for method_name, kernel in KERNELS.items():
+        # Первый вызов отдельной стадией: разовые отложенные импорты (scipy в spline) не входят в пропускную способность
+        timed(records, scale, f'warmup_{method_name}', lambda: kernel(grids[0]))
+        timed(records, scale, f'kernel_{method_name}', lambda: [kernel(g) for g in grids], len(ids))
+
+    return records
+
+def run_isolated(n_series, span_days, **options):
+    # Каждый масштаб в своём процессе, чтобы пик памяти не наследовался от предыдущего
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_scale, (n_series, span_days), options)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк TSDS на синтетическом collected.csv")
+    parser.add_argument('--scales', nargs='+', default=['100x365', '1000x365'], help="ряды x дни")
+    parser.add_argument('--gap-density', type=float, default=0.3)
+    parser.add_argument('--dup-rate', type=float, default=0.2)
+    parser.add_argument('--malformed-rate', type=float, default=0.01)
+    parser.add_argument('--sample', type=int, default=50, help="сколько рядов в замерах по одному ряду")
+    parser.add_argument('--out', help="JSON файл с результатами (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    records = []
+    for scale in args.scales:
+        n_series, span_days = (int(v) for v in scale.split('x'))
+        records += run_isolated(
+            n_series, span_days, sample=args.sample, gap_density=args.gap_density,
+            dup_rate=args.dup_rate, malformed_rate=args.malformed_rate
+        )
+
+    report = json.dumps(records, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+if __name__ == '__main__':
+    sys.exit(main())
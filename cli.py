@@ -0,0 +1,127 @@
+# %% TSDS - командная строка для пакетных задач (точка входа tsds из pyproject.toml)
+# tsds list --min-days 30
+# tsds select --out methods.csv
+# tsds backtest --masks 5 --out scores.csv
+# tsds interpolate 150000056 150000124 --method spline --out result.csv
+# tsds export --method auto --fmt parquet --workers 4
+# tsds startup --budget 300
+#
+# core, polars-планы и данные загружаются только внутри команд: tsds --help и startup ничего не читают
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Модули, которых не должно быть после import core: тянутся только при построении графиков и сплайнах
+HEAVY_MODULES = ['matplotlib', 'scipy']
+
+# Список здесь, а не из methods: импорт methods тянет Polars, а startup и --help не должны ничего загружать
+METHOD_CHOICES = ['auto', 'measured', 'linear', 'polynomial', 'spline', 'log']
+
+STARTUP_PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import core
+seconds = time.perf_counter() - start
+print(json.dumps({
+    'import_ms': round(seconds * 1000, 1),
+    'heavy_modules': sorted({name.split('.')[0] for name in sys.modules} & set(HEAVY_MODULES)),
+    'data_loaded': 'series_index' in vars(core)
+}))
+"""
+
+def measure_startup():
+    """Время import core в чистом процессе и что при этом подгрузилось"""
+    probe = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n" + STARTUP_PROBE
+    output = subprocess.run([sys.executable, '-c', probe], capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+def write_frame(df, out=None):
+    if out:
+        df.write_csv(out)
+        print(f"Данные сохранены: {out} ({df.height} строк)", file=sys.stderr)
+    else:
+        df.write_csv(sys.stdout)
+
+def cmd_list(args):
+    import core
+    series = core.get_series_list(args.min_days)
+    write_frame(series.head(args.top) if args.top else series, args.out)
+
+def cmd_select(args):
+    import core
+    write_frame(core.select_methods(args.ids or None, measured=args.measured), args.out)
+
+def cmd_backtest(args):
+    import core
+    write_frame(core.backtest_methods(args.ids or None, args.masks, args.holdout, args.seed), args.out)
+
+def cmd_interpolate(args):
+    import core
+    write_frame(core.interpolate_batch(args.ids or None, args.method, args.workers), args.out)
+
+def cmd_export(args):
+    import core
+    from data_utils import save_batch
+    save_batch(core.interpolate_batch(args.ids or None, args.method, args.workers), args.out_dir, args.fmt, args.id_buckets)
+
+def cmd_startup(args):
+    report = measure_startup()
+    print(json.dumps(report | {'budget_ms': args.budget}))
+    if report['import_ms'] > args.budget or report['heavy_modules'] or report['data_loaded']:
+        return 1
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='tsds', description="Пакетная интерполяция рядов TSDS")
+    parser.add_argument('--compact', action='store_true', help="компактное хранение данных в памяти (TSDS_COMPACT=1)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('list', help="ряды с длиной и полнотой")
+    command.add_argument('--min-days', type=int, default=0)
+    command.add_argument('--top', type=int, help="только первые N рядов")
+    command.add_argument('--out', help="CSV файл (по умолчанию stdout)")
+    command.set_defaults(func=cmd_list)
+
+    command = commands.add_parser('select', help="автовыбор метода для рядов")
+    command.add_argument('ids', nargs='*', help="id рядов (по умолчанию все)")
+    command.add_argument('--measured', action='store_true', help="выбор по ошибке на скрытых точках (backtest)")
+    command.add_argument('--out', help="CSV файл (по умолчанию stdout)")
+    command.set_defaults(func=cmd_select)
+
+    command = commands.add_parser('backtest', help="ошибки методов на скрытых известных точках")
+    command.add_argument('ids', nargs='*', help="id рядов (по умолчанию все)")
+    command.add_argument('--masks', type=int, default=3, help="сколько случайных масок на ряд")
+    command.add_argument('--holdout', type=float, default=0.1, help="доля скрываемых точек")
+    command.add_argument('--seed', type=int, default=0)
+    command.add_argument('--out', help="CSV файл (по умолчанию stdout)")
+    command.set_defaults(func=cmd_backtest)
+
+    command = commands.add_parser('interpolate', help="заполнение пропусков, результат в CSV")
+    command.add_argument('ids', nargs='*', help="id рядов (по умолчанию все)")
+    command.add_argument('--method', choices=METHOD_CHOICES, default='auto')
+    command.add_argument('--workers', type=int, default=1)
+    command.add_argument('--out', help="CSV файл (по умолчанию stdout)")
+    command.set_defaults(func=cmd_interpolate)
+
+    command = commands.add_parser('export', help="заполнение пропусков и запись набором файлов (save_batch)")
+    command.add_argument('ids', nargs='*', help="id рядов (по умолчанию все)")
+    command.add_argument('--method', choices=METHOD_CHOICES, default='auto')
+    command.add_argument('--workers', type=int, default=1)
+    command.add_argument('--fmt', choices=['parquet', 'csv'], default='parquet')
+    command.add_argument('--out-dir', default='data/processed')
+    command.add_argument('--id-buckets', type=int, help="разбиение parquet по корзинам id")
+    command.set_defaults(func=cmd_export)
+
+    command = commands.add_parser('startup', help="проверка бюджета времени импорта core")
+    command.add_argument('--budget', type=float, default=300, help="миллисекунды")
+    command.set_defaults(func=cmd_startup)
+
+    args = parser.parse_args(argv)
+    if args.compact:
+        os.environ['TSDS_COMPACT'] = '1'
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
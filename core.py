@@ -1,27 +1,72 @@
-from methods import linear, polynomial, spline, log
-from data_utils import get_top_series, get_series_data, save_interpolated_data
-from auto_select import select_best_method
-from visualizer import plot_interpolation, compare_methods
-
-# Загружаем данные один раз
-df_clean, top_ids = get_top_series()
-
-METHODS = {
-    'linear': linear.interpolate,
-    'polynomial': polynomial.interpolate, 
-    'spline': spline.interpolate,
-    'log': log.interpolate
-}
-
-def interpolate_series(series_id, method='auto', save_csv=False):
-    original_data = get_series_data(df_clean, series_id)
-    
-    if method == 'auto':
-        selection = select_best_method(original_data)
-        method = selection['method']
-        print(f"Выбран метод: {method} ({selection['confidence']})")
-    
-    interpolated_data = METHODS[method](original_data)
+import os
+import polars as pl
+
+from methods import METHODS, KERNELS, FRAME_METHODS, build_grid, to_frame
+from data_utils import load_series_index, build_series_index, lookup_series, list_series, save_interpolated_data, save_batch, memory_report
+from auto_select import select_best_method, select_best_methods
+from backtest import backtest, choose_methods
+from parallel import run_tasks, RESULT_SCHEMA
+from instrument import timed
+from outages import drop_outages, flag_outages
+from memo import new_cache, make_key, cache_get, cache_put, cache_clear, cache_info
+
+# Компактный режим (TSDS_COMPACT=1): дневные строки, Categorical id, Date, Float32 в пределах точности исходника
+COMPACT = os.environ.get('TSDS_COMPACT') == '1'
+
+def load_data():
+    """Загружает данные один раз, при первом обращении (повторные запуски читают кэш data/cache)"""
+    global df_clean, top_ids, series_index
+    if 'series_index' not in globals():
+        df_clean, top_ids, series_index = load_series_index(cache_dir='data/cache', compact=COMPACT)
+        if COMPACT:
+            # Сырые строки уже дневные - отдельная копия не нужна, df_clean указывает на данные индекса
+            df_clean = series_index['data']
+    return series_index
+
+def __getattr__(name):
+    # core.series_index / core.df_clean / core.top_ids: импорт core данные не читает
+    if name in ('df_clean', 'top_ids', 'series_index'):
+        load_data()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Результаты по отдельным рядам (interpolate_series, compare_all_methods) для повторных просмотров
+result_cache = new_cache()
+
+def configure_cache(max_entries=256, max_bytes=256 * 1024 * 1024, cache_dir=None,
+                    max_disk_entries=4096, max_disk_bytes=1024 * 1024 * 1024):
+    """Новые лимиты кэша результатов; cache_dir (например 'data/cache/results') сохраняет записи между запусками"""
+    global result_cache
+    result_cache = new_cache(max_entries, max_bytes, cache_dir, max_disk_entries, max_disk_bytes)
+    return result_cache
+
+def clear_cache(disk=False):
+    cache_clear(result_cache, disk)
+
+def get_cache_info():
+    return cache_info(result_cache)
+
+@timed("interpolate_series", rows=lambda result: result[1].height)
+def interpolate_series(series_id, method='auto', save_csv=False, outages=None):
+    original_data = lookup_series(load_data(), series_id)
+    # Ключ включает содержимое ряда и календарь сбоев: изменились данные - запись не найдётся
+    key = make_key(series_id, method, None, original_data.drop("id"), outages)
+    cached = cache_get(result_cache, key)
+    if cached is not None:
+        interpolated_data, method = cached
+    else:
+        # Точки внутри сбоев (outages из load_outages) не используются и заполняются как пропуски
+        fit_data = original_data if outages is None else drop_outages(original_data, outages)
+
+        if method == 'auto':
+            selection = select_best_method(fit_data)
+            method = selection['method']
+            print(f"Выбран метод: {method} ({selection['confidence']})")
+
+        interpolated_data = METHODS[method](fit_data)
+        if outages is not None:
+            interpolated_data = flag_outages(interpolated_data, outages)
+        cache_put(result_cache, key, (interpolated_data, method))
     
     # Сохраняем если нужно
     if save_csv:
@@ -29,22 +74,163 @@ def interpolate_series(series_id, method='auto', save_csv=False):
     
     return original_data, interpolated_data, method
 
+@timed("interpolate_batch")
+def interpolate_batch(series_ids=None, method='auto', workers=1, save=None, options=None, outages=None):
+    """Заполняет все ряды (или series_ids) за один проход, возвращает длинный фрейм id/date/value/method.
+
+    save='parquet' или 'csv' сразу пишет результат одним набором файлов (см. save_batch).
+    options - параметры методов, например {'spline': {'window': 2}} для локальной подгонки длинных рядов.
+    outages - календарь сбоев: точки внутри сбоев пропускаются, дни сбоев помечаются колонкой outage.
+    method='measured' - выбор по ошибке на скрытых точках (backtest) вместо эвристик analyze_series.
+    """
+    index = load_data()
+    if outages is not None:
+        index = build_series_index(drop_outages(index['data'], outages))
+    if series_ids is None:
+        series_ids = list(index['offsets'])
+
+    if method not in ('auto', 'measured'):
+        result = fill_with_method(series_ids, method, workers, options, index)
+    else:
+        # Автовыбор сразу для всех рядов, затем каждая группа считается своим методом
+        selection = select_methods(series_ids, index, measured=method == 'measured')
+        result = fill_selected(selection, workers, options, index)
+        if method == 'measured':
+            result = check_measured(result, selection, workers, options, index)
+
+    if outages is not None:
+        result = flag_outages(result, outages)
+
+    if save:
+        save_batch(result, fmt=save)
+    return result
+
+def fill_with_method(series_ids, method, workers=1, options=None, index=None):
+    index = index or load_data()
+    if method in FRAME_METHODS:
+        # linear/log заполняются сразу по всем рядам выражениями Polars, без цикла и пула
+        lf = index['data'].lazy().filter(pl.col("id").is_in([str(i) for i in series_ids]))
+        return FRAME_METHODS[method](lf).with_columns(pl.lit(method).alias("method")).collect()
+    return run_tasks(index, series_ids, [method], workers, options=options)
+
+def fill_selected(selection, workers=1, options=None, index=None):
+    """Каждая группа таблицы id -> method считается своим методом"""
+    results = [
+        fill_with_method(group["id"].to_list(), method_name, workers, options, index)
+        for (method_name,), group in selection.partition_by("method", as_dict=True, maintain_order=True).items()
+    ]
+    return pl.concat(results) if results else pl.DataFrame(schema=RESULT_SCHEMA)
+
+def check_measured(result, selection, workers=1, options=None, index=None):
+    """Выбор по ошибке не должен оставлять пропуски там, где их нет у эвристики: такие ряды пересчитываются
+    эвристическим методом, если он другой и заполняет ряд целиком"""
+    unfilled = result.filter(pl.col("value").is_null())["id"].unique()
+    if unfilled.is_empty():
+        return result
+    heuristic = (
+        select_methods(unfilled.to_list(), index)
+        .with_columns(pl.col("id").cast(pl.String))
+        .join(selection, on=["id", "method"], how="anti")
+    )
+    refilled = fill_selected(heuristic, workers, options, index)
+    complete = refilled.group_by("id").agg(pl.col("value").is_not_null().all().alias("complete"))
+    replace = complete.filter("complete")["id"].implode()
+    return pl.concat([
+        result.filter(~pl.col("id").is_in(replace)), refilled.filter(pl.col("id").is_in(replace))
+    ])
+
+def select_methods(series_ids=None, index=None, measured=False):
+    """Таблица id -> method для всех рядов (или series_ids) одним векторным расчётом.
+
+    measured=True - метод с наименьшей ошибкой на скрытых точках и confidence из backtest;
+    ряды, которые проверить нечем (меньше 3 точек), получают эвристический выбор.
+    """
+    data = (index or load_data())['data']
+    if series_ids is not None:
+        data = data.filter(pl.col("id").is_in([str(i) for i in series_ids]))
+    selection = select_best_methods(data)
+    if not measured:
+        return selection
+    chosen = choose_methods(backtest(data)).select(["id", "method", "confidence"])
+    return (
+        selection.with_columns(pl.col("id").cast(pl.String))
+        .join(chosen, on="id", how="left", suffix="_measured", maintain_order="left")
+        .select(["id", pl.coalesce("method_measured", "method").alias("method"), "confidence"])
+    )
+
+def backtest_methods(series_ids=None, n_masks=3, holdout=0.1, seed=0):
+    """Ошибки всех методов по рядам на скрытых известных точках (см. backtest.backtest)"""
+    data = load_data()['data']
+    if series_ids is not None:
+        data = data.filter(pl.col("id").is_in([str(i) for i in series_ids]))
+    return backtest(data, n_masks=n_masks, holdout=holdout, seed=seed)
+
+@timed("compare_batch")
+def compare_batch(series_ids=None, workers=1, save=None, options=None):
+    """Все методы для всех рядов (или series_ids) одним фреймом; упавшие пары (ряд, метод) пропускаются"""
+    index = load_data()
+    if series_ids is None:
+        series_ids = list(index['offsets'])
+    result = run_tasks(index, series_ids, list(METHODS), workers, skip_errors=True, options=options)
+
+    if save:
+        save_batch(result, fmt=save)
+    return result
+
+def render_reports(series_ids=None, out_dir='data/reports', fmt='png', workers=1, options=None):
+    """Картинки сравнения методов для всех рядов (или series_ids) без GUI: png/svg по файлу на ряд или один pdf"""
+    from render import render_batch
+
+    index = load_data()
+    if series_ids is None:
+        series_ids = list(index['offsets'])
+    return render_batch(index, series_ids, out_dir, fmt, workers, options)
+
+def get_memory_report():
+    """Сколько памяти занимают загруженные данные и индекс"""
+    load_data()
+    frames = {'index_data': series_index['data'], 'index_stats': series_index['stats']}
+    if df_clean is not series_index['data']:
+        frames['df_clean'] = df_clean
+    return memory_report(frames)
+
+def get_series_list(min_days=0):
+    return list_series(load_data(), min_days)
+
 def plot_series(series_id, method='auto', save_csv=False):
+    from visualizer import plot_interpolation
+
     original_data, interpolated_data, used_method = interpolate_series(series_id, method, save_csv)
     plot_interpolation(original_data, interpolated_data, used_method, series_id)
 
-def compare_all_methods(series_id, save_csv=False):
-    original_data = get_series_data(df_clean, series_id)
-    results = {}
-    
-    for method_name, method_func in METHODS.items():
-        try:
-            results[method_name] = method_func(original_data)
-            # Сохраняем каждый метод если нужно
-            if save_csv and results[method_name] is not None:
-                save_interpolated_data(results[method_name], series_id, method_name)
-        except:
-            results[method_name] = None
+@timed("compare_all_methods")
+def compare_all_methods(series_id, save_csv=False, workers=1):
+    original_data = lookup_series(load_data(), series_id)
+    key = make_key(series_id, 'compare', None, original_data.drop("id"))
+    results = cache_get(result_cache, key)
+
+    if results is None:
+        if workers > 1:
+            # Методы считаются параллельно в отдельных процессах
+            batch = compare_batch([series_id], workers)
+            computed = {name[0]: frame.drop("method") for name, frame in batch.partition_by("method", as_dict=True).items()}
+            results = {method_name: computed.get(method_name) for method_name in METHODS}
+        else:
+            # Сетка строится один раз, методы работают только с массивами
+            grid = build_grid(original_data)
+            results = {}
+            for method_name, kernel in KERNELS.items():
+                try:
+                    results[method_name] = to_frame(grid, kernel(grid))
+                except:
+                    results[method_name] = None
+        cache_put(result_cache, key, results)
+
+    # Сохраняем каждый метод если нужно
+    if save_csv:
+        for method_name, result in results.items():
+            if result is not None:
+                save_interpolated_data(result, series_id, method_name)
     
+    from visualizer import compare_methods
     compare_methods(original_data, results, series_id)
-
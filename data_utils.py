@@ -1,5 +1,12 @@
 import polars as pl
 import os
+import glob
+import json
+import uuid
+import zlib
+import hashlib
+
+from instrument import timed
 
 def save_interpolated_data(data, series_id, method):
     """Сохраняет интерполированные данные в CSV файл"""
@@ -17,25 +24,78 @@ def save_interpolated_data(data, series_id, method):
     print(f"Данные сохранены: {filepath}")
     return filepath
 
-def get_top_series(input_file='data/raw/collected.csv', top_n=10):
-    df = pl.read_csv(
-        input_file,
-        has_header=False,
-        new_columns=['row_number', 'date', 'id', 'value']
+def id_bucket(series_id, buckets):
+    """Стабильная корзина id (между запусками и версиями Polars)"""
+    return zlib.crc32(str(series_id).encode()) % buckets
+
+@timed("save_batch")
+def save_batch(data, output_dir='data/processed', fmt='parquet', id_buckets=None, append=True):
+    """Сохраняет результаты пачкой за один проход вместо файла на каждый ряд.
+
+    parquet: датасет с разбиением method=.../[bucket=.../], каждый вызов дописывает свои файлы (append=False
+    заменяет затронутые разделы). csv: один файл на метод, при append строки дописываются в конец.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    os.makedirs(output_dir, exist_ok=True)
+    data = data.with_columns(pl.col("date").cast(pl.Date))
+
+    if fmt == 'csv':
+        for (method,), part in data.partition_by("method", as_dict=True, maintain_order=True).items():
+            filepath = os.path.join(output_dir, f'{method}_interpolated.csv')
+            write_header = not (append and os.path.exists(filepath))
+            with open(filepath, 'a' if append else 'w') as f:
+                part.drop("method").write_csv(f, include_header=write_header, datetime_format='%Y-%m-%d')
+        print(f"Данные сохранены: {output_dir} ({data.height} строк)")
+        return output_dir
+
+    partition_fields = [("method", pa.string())]
+    if id_buckets:
+        buckets = {i: id_bucket(i, id_buckets) for i in data["id"].unique()}
+        data = data.with_columns(pl.col("id").replace_strict(buckets, return_dtype=pl.Int32).alias("bucket"))
+        partition_fields.append(("bucket", pa.int32()))
+
+    # id словарём, сжатие zstd: повторяющиеся id и соседние даты почти ничего не занимают
+    table = data.with_columns(pl.col("id").cast(pl.Categorical)).to_arrow()
+    ds.write_dataset(
+        table,
+        output_dir,
+        format="parquet",
+        partitioning=ds.partitioning(pa.schema(partition_fields), flavor="hive"),
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore" if append else "delete_matching",
+        file_options=ds.ParquetFileFormat().make_write_options(compression="zstd")
     )
-    
-    pattern = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}[+-]\d{2}:\d{2}$"
-    df_clean = (
-        df.filter(pl.col("date").str.contains(pattern) & pl.col("value").is_not_null())
+    print(f"Данные сохранены: {output_dir} ({data.height} строк)")
+    return output_dir
+
+RAW_SCHEMA = {'row_number': pl.String, 'date': pl.String, 'id': pl.String, 'value': pl.String}
+CACHE_FORMAT = 2
+DATE_PATTERN = r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}[+-]\d{2}:\d{2}$"
+
+def clean_raw_data(lf, series_ids=None):
+    """Чистка сырых строк: корректные даты с часовым поясом и числовые значения"""
+    lf = lf.select(["date", "id", "value"])
+    if series_ids is not None:
+        lf = lf.filter(pl.col("id").is_in([str(i) for i in series_ids]))
+
+    return (
+        lf.filter(pl.col("date").str.contains(DATE_PATTERN) & pl.col("value").is_not_null())
         .with_columns([
             pl.col("date").str.strptime(pl.Datetime, "%Y-%m-%d %H:%M:%S%z"),
             pl.col("value").cast(pl.Float64, strict=False)
         ])
         .drop_nulls(["date", "value"])
-        .drop("row_number")
     )
 
-    stats = (
+def scan_clean_data(input_file='data/raw/collected.csv', series_ids=None):
+    """Ленивый план чистки сырого CSV: фильтры и выбор колонок выполняются прямо при чтении"""
+    return clean_raw_data(pl.scan_csv(input_file, has_header=False, schema=RAW_SCHEMA), series_ids)
+
+def get_series_stats(df_clean):
+    """Статистика по всем рядам: число дней с данными, охват и полнота"""
+    return (
         df_clean.with_columns(pl.col("date").dt.date().alias("day"))
         .group_by("id")
         .agg([
@@ -48,11 +108,133 @@ def get_top_series(input_file='data/raw/collected.csv', top_n=10):
         ])
         .with_columns((pl.col("unique_days") / pl.col("span_days")).alias("completeness"))
         .sort(["unique_days", "completeness"], descending=True)
-        .head(top_n)
     )
-    
-    return df_clean, stats["id"].to_list()
 
+def compact_frame(lf):
+    """Компактный план: одна (последняя) точка за день, дата как Date, id словарём (Categorical)"""
+    return (
+        lf.sort(["id", "date"])
+        .with_columns(pl.col("date").dt.date())
+        .unique(["id", "date"], keep="last", maintain_order=True)
+        .with_columns(pl.col("id").cast(pl.Categorical))
+    )
+
+# Значащие цифры исходного текста, которые должен сохранять Float32 компактного режима
+VALUE_DIGITS = 7
+
+def narrow_values(df, digits=VALUE_DIGITS):
+    """value во Float32, если это не теряет точности исходного текста: значения записаны не более чем digits
+    значащими цифрами и Float32, округлённый до digits цифр, даёт их же (280.3 -> Float32). Иначе остаётся Float64"""
+    value = pl.col("value")
+    narrow = value.cast(pl.Float32).cast(pl.Float64)
+    # Само округление до значащих цифр во Float64 неточно в последнем бите - сравниваем с относительным допуском
+    def same(a, b):
+        return (a - b).abs() <= 1e-12 * b.abs()
+    lossless = (narrow == value) | (same(value.round_sig_figs(digits), value) & same(narrow.round_sig_figs(digits), value))
+    if df.select(lossless.all()).item():
+        return df.with_columns(value.cast(pl.Float32))
+    return df
+
+def float_values(frame, digits=VALUE_DIGITS):
+    """Выражение value во Float64 для расчётов; Float32 после narrow_values округляется обратно до исходных цифр
+    (280.3 вместо 280.29998779), чтобы компактный режим давал те же результаты"""
+    value = pl.col("value").cast(pl.Float64)
+    if frame.collect_schema()["value"] == pl.Float32:
+        return value.round_sig_figs(digits)
+    return value
+
+def source_fingerprint(input_file, series_ids=None, compact=False):
+    """Отпечаток исходника и параметров чистки: меняется при изменении файла или фильтров"""
+    st = os.stat(input_file)
+    key = [
+        CACHE_FORMAT, os.path.abspath(input_file), st.st_size, st.st_mtime_ns, DATE_PATTERN,
+        sorted(str(i) for i in series_ids) if series_ids is not None else None, compact
+    ]
+    return hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+
+def temp_path(path):
+    """Временный файл рядом с path, свой у каждого писателя: параллельные холодные старты не пишут в один файл"""
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex}.tmp"
+
+def write_atomic(df, path):
+    tmp = temp_path(path)
+    df.write_ipc(tmp)
+    os.replace(tmp, path)
+
+def remove_quietly(path):
+    # Тот же устаревший кэш может одновременно удалять другой процесс
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def evict_stale_cache(cache_dir, input_file):
+    """Удаляет кэш того же исходника с другим размером/mtime; записи других параметров чистки остаются"""
+    st = os.stat(input_file)
+    source = os.path.abspath(input_file)
+    for meta_path in glob.glob(os.path.join(cache_dir, 'meta_*.json')):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta['source'] == source and (meta['size'], meta['mtime_ns']) != (st.st_size, st.st_mtime_ns):
+            key = os.path.basename(meta_path)[len('meta_'):-len('.json')]
+            for old_path in glob.glob(os.path.join(cache_dir, f'*_{key}.arrow')):
+                remove_quietly(old_path)
+            remove_quietly(meta_path)
+    # Файлы без описания остались от кэша прежнего формата
+    known = {os.path.basename(path)[len('meta_'):-len('.json')] for path in glob.glob(os.path.join(cache_dir, 'meta_*.json'))}
+    for path in glob.glob(os.path.join(cache_dir, '*_*.arrow')):
+        if os.path.basename(path).rsplit('_', 1)[1][:-len('.arrow')] not in known:
+            remove_quietly(path)
+
+@timed("load", rows=lambda result: result[0].height)
+def load_clean_data(input_file='data/raw/collected.csv', series_ids=None, cache_dir=None, compact=False):
+    """Чистые данные и статистика рядов; с cache_dir берутся из Arrow IPC кэша, пока исходник не менялся.
+
+    compact=True - дневные строки с узкими типами (compact_frame, narrow_values): заметно меньше памяти на процесс.
+    """
+    if cache_dir is None:
+        # Потоковое чтение: сырая таблица целиком в памяти не держится
+        if compact:
+            df_clean = narrow_values(compact_frame(scan_clean_data(input_file, series_ids)).collect(engine="streaming"))
+        else:
+            df_clean = scan_clean_data(input_file, series_ids).collect(engine="streaming")
+        return df_clean, get_series_stats(df_clean)
+
+    key = source_fingerprint(input_file, series_ids, compact)
+    data_path = os.path.join(cache_dir, f'clean_{key}.arrow')
+    stats_path = os.path.join(cache_dir, f'stats_{key}.arrow')
+
+    if not (os.path.exists(data_path) and os.path.exists(stats_path)):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Устаревшие версии этого же файла больше не нужны; кэш с другими параметрами (compact, series_ids) нужен другим процессам
+        evict_stale_cache(cache_dir, input_file)
+        # Описание записи пишется до данных, чтобы параллельный процесс не счёл их чужими
+        st = os.stat(input_file)
+        meta_path = os.path.join(cache_dir, f'meta_{key}.json')
+        meta_tmp = temp_path(meta_path)
+        with open(meta_tmp, 'w') as f:
+            json.dump({'source': os.path.abspath(input_file), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, f)
+        os.replace(meta_tmp, meta_path)
+
+        # Пишем сразу из потокового плана на диск, затем атомарно переименовываем
+        if compact:
+            write_atomic(narrow_values(compact_frame(scan_clean_data(input_file, series_ids)).collect(engine="streaming")), data_path)
+        else:
+            data_tmp = temp_path(data_path)
+            scan_clean_data(input_file, series_ids).sink_ipc(data_tmp)
+            os.replace(data_tmp, data_path)
+        write_atomic(get_series_stats(pl.read_ipc(data_path, memory_map=True)), stats_path)
+
+    # Несжатый IPC читается через memory-map без копирования
+    df_clean = pl.read_ipc(data_path, memory_map=True, rechunk=False)
+    stats = pl.read_ipc(stats_path, memory_map=True, rechunk=False)
+    return df_clean, stats
+
+def get_top_series(input_file='data/raw/collected.csv', top_n=10, series_ids=None, cache_dir=None, compact=False):
+    df_clean, stats = load_clean_data(input_file, series_ids, cache_dir, compact)
+    return df_clean, stats.head(top_n)["id"].to_list()
+
+@timed("lookup_scan")
 def get_series_data(df_clean, series_id):
     return (
         df_clean.filter(pl.col("id") == str(series_id))
@@ -62,4 +244,97 @@ def get_series_data(df_clean, series_id):
         .tail(1)
         .drop("day")
         .select(["id", "date", "value"])
-    )
\ No newline at end of file
+    )
+
+def get_daily_rows(df_clean):
+    """Все ряды по дням: сортировка по id и дате, последняя точка за день"""
+    return (
+        df_clean.sort(["id", "date"])
+        .with_columns(pl.col("date").dt.date().alias("day"))
+        .unique(["id", "day"], keep="last", maintain_order=True)
+        .select(["id", "date", "value"])
+    )
+
+@timed("build_index", rows=lambda index: index['data'].height)
+def build_series_index(df_clean):
+    """Индекс рядов: дневные данные, отсортированные по id, и смещение каждого id в них"""
+    return index_from_frames(*index_frames(df_clean))
+
+def index_frames(df_clean):
+    """Дневные данные по id/дате и статистика рядов с колонкой offset - всё, что нужно индексу"""
+    data = get_daily_rows(df_clean)
+    stats = (
+        data.group_by("id", maintain_order=True)
+        .agg([
+            pl.len().alias("unique_days"),
+            pl.col("date").first().alias("min_date"),
+            pl.col("date").last().alias("max_date")
+        ])
+        .with_columns([
+            (pl.col("unique_days").cum_sum() - pl.col("unique_days")).alias("offset"),
+            ((pl.col("max_date").dt.date() - pl.col("min_date").dt.date()).dt.total_days().cast(pl.Int32) + 1).alias("span_days")
+        ])
+        .with_columns((pl.col("unique_days") / pl.col("span_days")).alias("completeness"))
+    )
+    return data, stats
+
+def index_from_frames(data, stats):
+    """Словарь индекса из дневных данных и статистики с колонкой offset"""
+    offsets = {
+        series_id: (offset, length)
+        for series_id, offset, length in zip(stats["id"], stats["offset"], stats["unique_days"])
+    }
+    return {'data': data, 'offsets': offsets, 'stats': stats.drop("offset")}
+
+def load_series_index(input_file='data/raw/collected.csv', series_ids=None, cache_dir=None, compact=False, top_n=10):
+    """Чистые данные, top_n рядов и индекс; с cache_dir индекс (уже отсортированный по id/дате, по строке на день)
+    тоже лежит в кэше, и тёплый старт только отображает его в память без сортировки"""
+    df_clean, series_stats = load_clean_data(input_file, series_ids, cache_dir, compact)
+    top_ids = series_stats.head(top_n)["id"].to_list()
+    if cache_dir is None:
+        return df_clean, top_ids, build_series_index(df_clean)
+
+    key = source_fingerprint(input_file, series_ids, compact)
+    data_path = os.path.join(cache_dir, f'index_{key}.arrow')
+    stats_path = os.path.join(cache_dir, f'offsets_{key}.arrow')
+    if not (os.path.exists(data_path) and os.path.exists(stats_path)):
+        data, stats = index_frames(df_clean)
+        write_atomic(data, data_path)
+        write_atomic(stats, stats_path)
+
+    data = pl.read_ipc(data_path, memory_map=True, rechunk=False)
+    return df_clean, top_ids, index_from_frames(data, pl.read_ipc(stats_path, memory_map=True, rechunk=False))
+
+def lookup_series(index, series_id):
+    """Ряд из индекса без сканирования таблицы (срез без копирования)"""
+    if str(series_id) not in index['offsets']:
+        raise KeyError(f"ряд {series_id} не найден")
+    offset, length = index['offsets'][str(series_id)]
+    return index['data'].slice(offset, length)
+
+def list_series(index, min_days=0):
+    """Список рядов с длиной, охватом и полнотой из готового индекса"""
+    return (
+        index['stats']
+        .filter(pl.col("unique_days") >= min_days)
+        .sort(["unique_days", "completeness"], descending=True)
+    )
+
+def frame_memory(df):
+    """Размер фрейма в байтах и тип по колонкам (оценка Polars, для memory-map - отображённые буферы)"""
+    columns = {name: df[name].estimated_size() for name in df.columns}
+    return {
+        'rows': df.height, 'bytes': sum(columns.values()), 'columns': columns,
+        'dtypes': {name: str(dtype) for name, dtype in df.schema.items()}
+    }
+
+def memory_report(frames):
+    """Память по фреймам {имя: DataFrame} и пиковый RSS процесса, байты"""
+    import resource
+    report = {name: frame_memory(df) for name, df in frames.items()}
+    report['total_bytes'] = sum(item['bytes'] for item in report.values())
+    # Какой тип выбрал narrow_values (Float32 в компактном режиме, если точность исходника позволяет)
+    report['value_dtype'] = next((str(df.schema['value']) for df in frames.values() if 'value' in df.columns), None)
+    # ru_maxrss в Linux - килобайты
+    report['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return report
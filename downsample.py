@@ -0,0 +1,58 @@
+import numpy as np
+import polars as pl
+
+def lttb(x, y, n_out):
+    """Индексы точек по Largest-Triangle-Three-Buckets: форма линии сохраняется при n_out точках"""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Первая и последняя точки остаются, внутренние делятся на n_out - 2 корзины
+    edges = np.floor(np.linspace(1, n - 1, n_out - 1)).astype(int)
+    counts = np.diff(edges)
+    avg_x = np.append(np.add.reduceat(x[:n - 1], edges[:-1]) / counts, x[-1])
+    avg_y = np.append(np.add.reduceat(y[:n - 1], edges[:-1]) / counts, y[-1])
+
+    selected = np.empty(n_out, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Точка корзины с наибольшей площадью треугольника (предыдущая выбранная, она, среднее следующей)
+        area = np.abs((x[a] - avg_x[i + 1]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i + 1] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+def to_plot_arrays(data, max_points=None, x="date", y="value"):
+    """Колонки фрейма как NumPy-массивы для matplotlib, при необходимости прорежённые LTTB"""
+    x_values = data[x].to_numpy()
+    y_values = data[y].to_numpy()
+    if max_points and len(x_values) > max_points:
+        x_numeric = x_values.astype('datetime64[us]').astype(np.int64) if x_values.dtype.kind == 'M' else x_values
+        keep = lttb(x_numeric, y_values, max_points)
+        x_values, y_values = x_values[keep], y_values[keep]
+    return x_values, y_values
+
+def downsample_frame(data, n_out, by="id", x="date", y="value"):
+    """Min/max прореживание длинного фрейма по каждому ряду прямо в Polars: не больше ~n_out точек на ряд.
+
+    В каждой из n_out / 2 корзин ряда остаются минимум и максимум, плюс первая и последняя точки ряда.
+    """
+    buckets = max(n_out // 2, 1)
+    position = pl.int_range(pl.len()).over(by)
+    bucket = (position * buckets // pl.len().over(by)).alias("_bucket")
+    in_bucket = pl.int_range(pl.len()).over([by, "_bucket"])
+    return (
+        data.sort([by, x])
+        .with_columns(bucket)
+        .filter(
+            (in_bucket == pl.col(y).arg_min().over([by, "_bucket"]))
+            | (in_bucket == pl.col(y).arg_max().over([by, "_bucket"]))
+            | (position == 0)
+            | (position == pl.len().over(by) - 1)
+        )
+        .drop("_bucket")
+    )
@@ -0,0 +1,371 @@
+import io
+import os
+import glob
+import json
+import uuid
+import shutil
+import hashlib
+
+import polars as pl
+
+from methods import FRAME_METHODS
+from auto_select import select_best_methods
+from parallel import run_tasks
+from data_utils import (
+    RAW_SCHEMA, clean_raw_data, get_daily_rows, id_bucket, build_series_index, write_atomic, remove_quietly
+)
+
+# Сколько известных точек с каждой стороны новых данных пересчитывается.
+# linear/log локальны: достаточно соседней точки. polynomial/spline глобальны: перестраиваем в окне.
+WINDOWS = {'linear': 1, 'log': 1, 'polynomial': 30, 'spline': 30}
+
+STATE_SCHEMA = {
+    "id": pl.String, "date": pl.Date, "value": pl.Int64, "observed": pl.Float64, "method": pl.String
+}
+
+# Состояние разбито по корзинам id (как save_batch). Запуск дописывает в корзину часть только с изменёнными
+# строками; более поздняя часть перекрывает ранние по id/дате. Сливает части compact_state, не refresh
+STATE_BUCKETS = 256
+STATE_FORMAT = 3
+
+# Сводка ряда рядом с частями корзины: по ней refresh находит участки без чтения истории.
+# count/nonpositive - число известных точек и неположительных среди них (сдвиг log решается по всему ряду)
+SUMMARY_SCHEMA = {
+    "id": pl.String, "method": pl.String, "first": pl.Date, "last": pl.Date, "count": pl.Int64, "nonpositive": pl.Int64
+}
+# Хвост ряда в сводке: последние WINDOWS[method] + 1 известных точек (лишняя - на повтор последнего дня)
+TAIL_SCHEMA = {"dates": pl.List(pl.Date), "values": pl.List(pl.Float64)}
+
+# Сколько первых байт исходника хранится отпечатком: по нему видно, что файл заменён
+HEAD_BYTES = 4096
+
+def series_info(summary, known, new_days, windows=None):
+    """Сводка затронутых рядов с учётом новых точек.
+
+    known - известные точки рядов (хвост из сводки или вся история). complete - known хватает на участок:
+    перед новыми точками есть window известных или known - вся история ряда. refit - у log поменялся сдвиг,
+    и ряд пересчитывается целиком (по всей истории).
+    """
+    windows = {**WINDOWS, **(windows or {})}
+    added = new_days.group_by("id").agg([
+        pl.col("date").min().alias("new_start"),
+        pl.col("date").max().alias("new_end"),
+        pl.len().cast(pl.Int64).alias("added"),
+        (pl.col("value") <= 0).sum().cast(pl.Int64).alias("added_nonpositive")
+    ])
+    # Новая точка за уже известный день заменяет старую
+    replaced = known.join(new_days, on=["id", "date"], how="semi").group_by("id").agg([
+        pl.len().cast(pl.Int64).alias("replaced"),
+        (pl.col("value") <= 0).sum().cast(pl.Int64).alias("replaced_nonpositive")
+    ])
+    coverage = known.join(added.select(["id", "new_start"]), on="id").group_by("id").agg([
+        pl.len().cast(pl.Int64).alias("known"),
+        (pl.col("date") < pl.col("new_start")).sum().cast(pl.Int64).alias("known_before")
+    ])
+    nonpositive = pl.col("nonpositive") - pl.col("replaced_nonpositive") + pl.col("added_nonpositive")
+    return (
+        summary.join(added, on="id")
+        .join(replaced, on="id", how="left")
+        .join(coverage, on="id", how="left")
+        .with_columns(pl.col(["replaced", "replaced_nonpositive", "known", "known_before"]).fill_null(0))
+        .with_columns(pl.col("method").replace_strict(windows, default=1, return_dtype=pl.Int64).alias("window"))
+        .with_columns([
+            (pl.col("count") - pl.col("replaced") + pl.col("added")).alias("count"),
+            nonpositive.alias("nonpositive"),
+            (nonpositive > 0).alias("shift"),
+            ((pl.col("method") == "log") & (pl.col("count") > 0) & ((pl.col("nonpositive") > 0) != (nonpositive > 0)))
+            .alias("refit"),
+            ((pl.col("known_before") >= pl.col("window")) | (pl.col("known") == pl.col("count"))).alias("complete"),
+            pl.min_horizontal("first", "new_start").alias("first"),
+            pl.max_horizontal("last", "new_end").alias("last")
+        ])
+    )
+
+def update_segments(known, new_days, info, workers=1):
+    """Пересчитывает участки рядов, затронутые новыми точками, сразу для всех рядов.
+
+    known - известные точки id/date/value (хвосты или вся история), new_days - новые дневные точки, info -
+    series_info. linear/log считаются одним вызовом FRAME_METHODS на все участки, остальные методы - run_tasks.
+    Возвращает только пересчитанные строки.
+    """
+    observed = pl.concat([known.join(new_days, on=["id", "date"], how="anti"), new_days])
+
+    bounds = info.select(["id", "method", "window", "shift", "refit", "new_start", "new_end", "first", "last"])
+    window = pl.col("window").first()
+    edges = (
+        known.join(bounds.select(["id", "window", "new_start", "new_end"]), on="id")
+        .group_by("id")
+        .agg([
+            # Граница участка - window-я известная точка с каждой стороны новых данных
+            pl.col("date").filter(pl.col("date") < pl.col("new_start")).top_k(window).min().alias("before"),
+            pl.col("date").filter(pl.col("date") > pl.col("new_end")).bottom_k(window).max().alias("after")
+        ])
+    )
+    # Если сдвиг у log поменялся, старое заполнение всего ряда посчитано с другим сдвигом - пересчитываем весь ряд
+    bounds = bounds.join(edges, on="id", how="left").with_columns([
+        pl.when("refit").then(pl.col("first")).otherwise(pl.coalesce("before", "new_start")).alias("segment_start"),
+        pl.when("refit").then(pl.col("last")).otherwise(pl.coalesce("after", "new_end")).alias("segment_end")
+    ])
+    segments = (
+        observed.join(bounds.select(["id", "method", "shift", "segment_start", "segment_end"]), on="id")
+        .filter(pl.col("date").is_between(pl.col("segment_start"), pl.col("segment_end")))
+    )
+
+    filled = []
+    for (method,), part in segments.partition_by("method", as_dict=True).items():
+        data = part.select(["id", "date", "value"])
+        if method in FRAME_METHODS:
+            options = {'shift': part.select(["id", "shift"]).unique("id")} if method == 'log' else {}
+            values = FRAME_METHODS[method](data.lazy(), **options).collect()
+        else:
+            index = build_series_index(data)
+            values = run_tasks(index, list(index['offsets']), [method], workers).drop("method")
+        filled.append(values.with_columns(pl.lit(method).alias("method")))
+    if not filled:
+        return pl.DataFrame(schema=STATE_SCHEMA)
+
+    return (
+        pl.concat(filled)
+        .join(segments.select(["id", "date", pl.col("value").alias("observed")]), on=["id", "date"], how="left")
+        .select(list(STATE_SCHEMA))
+        .sort(["id", "date"])
+    )
+
+def daily_points(new_data):
+    return new_data.select(["id", pl.col("date").dt.date(), pl.col("value").cast(pl.Float64)])
+
+def update_series(history, new_data, method, window=None):
+    """Дополняет заполненный ряд новыми точками, пересчитывая только затронутый ими участок.
+
+    history - состояние ряда (id/date/value/observed/method), new_data - новые дневные точки id/date/value.
+    """
+    known = (
+        history.filter(pl.col("observed").is_not_null())
+        .select(["id", "date", pl.col("observed").alias("value")])
+    )
+    summary = pl.DataFrame({
+        "id": [new_data["id"][0]], "method": [method], "first": [known["date"].min()], "last": [known["date"].max()],
+        "count": [known.height], "nonpositive": [int((known["value"] <= 0).sum())]
+    }, schema=SUMMARY_SCHEMA)
+    new_days = daily_points(new_data)
+    info = series_info(summary, known, new_days, {method: window} if window else None)
+    changed = update_segments(known, new_days, info)
+    return pl.concat([history.join(changed, on=["id", "date"], how="anti"), changed]).sort("date")
+
+def complete_lines(input_file, block_size=1 << 20):
+    """Число полных строк файла и позиция конца последней из них; читается блоками, память не растёт с файлом"""
+    lines = end = position = 0
+    with open(input_file, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            newlines = block.count(b'\n')
+            if newlines:
+                lines += newlines
+                end = position + block.rfind(b'\n') + 1
+            position += len(block)
+    return lines, end
+
+def read_new_rows(input_file, offset):
+    """Читает только дописанные с прошлого запуска полные строки сырого CSV"""
+    if offset == 0:
+        # Первый запуск или новый файл: потоковая чистка, как в load_clean_data, без чтения файла целиком.
+        # Строк берём столько, сколько было полных при подсчёте: недописанная и дописанные позже - на следующий запуск
+        lines, end = complete_lines(input_file)
+        if not lines:
+            return None, offset
+        raw = pl.scan_csv(input_file, has_header=False, schema=RAW_SCHEMA).head(lines)
+        return clean_raw_data(raw).collect(engine="streaming"), end
+
+    with open(input_file, 'rb') as f:
+        f.seek(offset)
+        chunk = f.read()
+    # Недописанную последнюю строку оставляем на следующий запуск
+    chunk = chunk[:chunk.rfind(b'\n') + 1]
+    if not chunk:
+        return None, offset
+
+    raw = pl.read_csv(io.BytesIO(chunk), has_header=False, schema=RAW_SCHEMA)
+    return clean_raw_data(raw.lazy()).collect(), offset + len(chunk)
+
+def bucket_dir(state_dir, bucket):
+    return os.path.join(state_dir, f'bucket={bucket:04d}')
+
+def bucket_parts(state_dir, bucket):
+    return sorted(glob.glob(os.path.join(bucket_dir(state_dir, bucket), 'part-*.arrow')))
+
+def latest_rows(df):
+    """Из частей корзины (по порядку записи) оставляет последнюю строку каждого id/даты"""
+    return df.unique(["id", "date"], keep="last", maintain_order=True)
+
+def read_bucket(paths):
+    if not paths:
+        return pl.DataFrame(schema=STATE_SCHEMA)
+    if len(paths) == 1:
+        return pl.read_ipc(paths[0], memory_map=False)
+    return latest_rows(pl.concat([pl.read_ipc(path, memory_map=False) for path in paths]))
+
+def read_state(state_dir='data/state'):
+    """Всё состояние одним фреймом (для проверки и выгрузки; refresh читает только сводки корзин)"""
+    buckets = [bucket_parts(state_dir, int(path.rsplit('=', 1)[1])) for path in glob.glob(os.path.join(state_dir, 'bucket=*'))]
+    state = pl.concat([read_bucket(paths) for paths in buckets if paths] or [pl.DataFrame(schema=STATE_SCHEMA)])
+    return state.sort(["id", "date"])
+
+def read_observed(state_dir, series_ids):
+    """Все известные точки рядов из частей их корзин - только для рядов, которым не хватает хвоста из сводки"""
+    buckets = {id_bucket(series_id, STATE_BUCKETS) for series_id in series_ids}
+    ids = pl.Series(list(series_ids), dtype=pl.String).implode()
+    return pl.concat([
+        read_bucket(bucket_parts(state_dir, bucket))
+        .filter(pl.col("id").is_in(ids) & pl.col("observed").is_not_null())
+        .select(["id", "date", pl.col("observed").alias("value")])
+        for bucket in buckets
+    ])
+
+def read_summary(state_dir, bucket):
+    """Сводка рядов корзины с хвостами"""
+    path = os.path.join(bucket_dir(state_dir, bucket), 'summary.arrow')
+    if not os.path.exists(path):
+        return pl.DataFrame(schema={**SUMMARY_SCHEMA, **TAIL_SCHEMA})
+    return pl.read_ipc(path, memory_map=False)
+
+def compact_state(state_dir='data/state'):
+    """Сливает части каждой корзины в одну.
+
+    refresh только дописывает части; слияние запускается отдельно (не параллельно с refresh), когда частей
+    накопилось много и read_state или перечитывание истории рядов стали дорогими.
+    """
+    for path in glob.glob(os.path.join(state_dir, 'bucket=*')):
+        parts = bucket_parts(state_dir, int(path.rsplit('=', 1)[1]))
+        if len(parts) < 2:
+            continue
+        # Слитая часть встаёт на место последней: после сбоя до удаления ранних она всё равно перекрывает их
+        write_atomic(read_bucket(parts).sort(["id", "date"]), parts[-1])
+        for old_path in parts[:-1]:
+            remove_quietly(old_path)
+
+def source_head(input_file, offset):
+    """sha1 начала файла (до offset, не больше HEAD_BYTES)"""
+    with open(input_file, 'rb') as f:
+        return hashlib.sha1(f.read(min(offset, HEAD_BYTES))).hexdigest()
+
+def saved_meta(meta_path, input_file):
+    """meta прошлого запуска, если исходник тот же; иначе None.
+
+    Заменённый (ротация), обрезанный файл или состояние старого формата начинают с нуля: кроме размера
+    сверяются inode и отпечаток первых байт, иначе новый файл, уже выросший дальше старой позиции, читался бы
+    с середины строки.
+    """
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    st = os.stat(input_file)
+    same_source = (
+        meta.get('format') == STATE_FORMAT and meta['buckets'] == STATE_BUCKETS
+        and meta['input_file'] == os.path.abspath(input_file)
+        and meta['offset'] <= st.st_size and meta['inode'] == st.st_ino
+        and meta['head'] == source_head(input_file, meta['offset'])
+    )
+    return meta if same_source else None
+
+def save_meta(meta_path, input_file, offset, runs):
+    with open(meta_path, 'w') as f:
+        json.dump({
+            'input_file': os.path.abspath(input_file), 'offset': offset, 'runs': runs,
+            'inode': os.stat(input_file).st_ino, 'head': source_head(input_file, offset),
+            'buckets': STATE_BUCKETS, 'format': STATE_FORMAT
+        }, f)
+
+def clear_state(state_dir):
+    # Вместе с файлами прежних форматов (state.arrow, bucket=NNNN.arrow)
+    for old_path in glob.glob(os.path.join(state_dir, 'bucket=*')) + glob.glob(os.path.join(state_dir, 'state.arrow')):
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        else:
+            os.remove(old_path)
+
+def by_bucket(df, buckets):
+    return df.with_columns(
+        pl.col("id").replace_strict(buckets, return_dtype=pl.Int32).alias("bucket")
+    ).partition_by("bucket", as_dict=True, include_key=False)
+
+def refresh(input_file='data/raw/collected.csv', state_dir='data/state', method='auto', workers=1):
+    """Инкрементальное обновление: дочитывает новые строки и пересчитывает только затронутые участки рядов.
+
+    Состояние (заполненные ряды частями по корзинам id, сводки рядов и позиция в исходнике) хранится в
+    state_dir. method применяется к новым рядам, у уже известных остаётся сохранённый метод. Участки находятся
+    по сводкам с хвостами рядов, история читается только у рядов, где хвоста не хватает (точки задним числом,
+    смена сдвига log): время ежедневного запуска зависит от объёма новых данных, а не от длины истории.
+    Возвращает только пересчитанные строки (весь ряд - read_state).
+    """
+    meta_path = os.path.join(state_dir, 'meta.json')
+    meta = saved_meta(meta_path, input_file)
+    if meta is None:
+        clear_state(state_dir)
+    offset, runs = (meta['offset'], meta['runs']) if meta else (0, 0)
+
+    new_rows, new_offset = read_new_rows(input_file, offset)
+    if new_rows is None or new_rows.is_empty():
+        # Хвост из одних некорректных строк тоже прочитан: позицию сохраняем, чтобы не разбирать его снова
+        if new_offset != offset:
+            os.makedirs(state_dir, exist_ok=True)
+            save_meta(meta_path, input_file, new_offset, runs)
+        return pl.DataFrame(schema=STATE_SCHEMA)
+
+    new_days = daily_points(get_daily_rows(new_rows))
+    touched = new_days["id"].unique()
+    buckets = {series_id: id_bucket(series_id, STATE_BUCKETS) for series_id in touched}
+    summaries = {bucket: read_summary(state_dir, bucket) for bucket in set(buckets.values())}
+    summary = pl.concat(list(summaries.values())).filter(pl.col("id").is_in(touched.implode()))
+    known = (
+        summary.select(["id", pl.col("dates").alias("date"), pl.col("values").alias("value")])
+        .explode(["date", "value"])
+        .drop_nulls("date")
+    )
+    summary = summary.select(list(SUMMARY_SCHEMA))
+
+    new_series = new_days.join(summary, on="id", how="anti")
+    if not new_series.is_empty():
+        if method == 'auto':
+            new_methods = select_best_methods(new_series)
+        else:
+            new_methods = new_series.select(pl.col("id").unique(), pl.lit(method).alias("method"))
+        summary = pl.concat([summary, new_methods.with_columns([
+            pl.lit(None, pl.Date).alias("first"), pl.lit(None, pl.Date).alias("last"),
+            pl.lit(0, pl.Int64).alias("count"), pl.lit(0, pl.Int64).alias("nonpositive")
+        ]).select(list(SUMMARY_SCHEMA))])
+
+    info = series_info(summary, known, new_days)
+    incomplete = info.filter(~pl.col("complete") | pl.col("refit"))["id"]
+    if not incomplete.is_empty():
+        known = pl.concat([
+            known.filter(~pl.col("id").is_in(incomplete.implode())), read_observed(state_dir, incomplete.to_list())
+        ])
+        info = series_info(summary, known, new_days)
+
+    changed = update_segments(known, new_days, info, workers=workers)
+
+    observed = pl.concat([known.join(new_days, on=["id", "date"], how="anti"), new_days])
+    tails = (
+        observed.join(info.select(["id", "window"]), on="id")
+        .filter(pl.col("date").rank("ordinal", descending=True).over("id") <= pl.col("window") + 1)
+        .sort(["id", "date"])
+        .group_by("id")
+        .agg([pl.col("date").alias("dates"), pl.col("value").alias("values")])
+    )
+
+    # Части по порядку запусков; повтор после сбоя до записи meta пишет рядом новую, не затирая записанную
+    os.makedirs(state_dir, exist_ok=True)
+    runs += 1
+    changed_buckets = by_bucket(changed, buckets)
+    new_summaries = by_bucket(info.select(list(SUMMARY_SCHEMA)).join(tails, on="id", how="left"), buckets)
+    for bucket, old_summary in summaries.items():
+        path = bucket_dir(state_dir, bucket)
+        os.makedirs(path, exist_ok=True)
+        if (bucket,) in changed_buckets:
+            write_atomic(changed_buckets[(bucket,)], os.path.join(path, f'part-{runs:06d}-{uuid.uuid4().hex[:8]}.arrow'))
+        write_atomic(pl.concat([
+            old_summary.filter(~pl.col("id").is_in(touched.implode())), new_summaries[(bucket,)]
+        ]), os.path.join(path, 'summary.arrow'))
+    save_meta(meta_path, input_file, new_offset, runs)
+
+    return changed
@@ -0,0 +1,117 @@
+import json
+import time
+import tracemalloc
+from functools import wraps
+from contextlib import contextmanager
+
+# Выключено по умолчанию: обёртка тогда только проверяет флаг и вызывает функцию
+ENABLED = False
+STATS = {}
+
+def enable(trace_alloc=False):
+    """Включает сбор статистики; trace_alloc - ещё и учёт аллокаций Python/NumPy через tracemalloc"""
+    global ENABLED
+    ENABLED = True
+    if trace_alloc and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable():
+    global ENABLED
+    ENABLED = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def reset():
+    STATS.clear()
+
+def _stage_stats(name):
+    if name not in STATS:
+        STATS[name] = {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0, 'alloc_bytes': 0, 'counters': {}}
+    return STATS[name]
+
+def count(name, counter, value=1):
+    """Добавляет значение к счётчику стадии (например, число пропусков)"""
+    if ENABLED:
+        counters = _stage_stats(name)['counters']
+        counters[counter] = counters.get(counter, 0) + value
+
+def _record(name, seconds, rows, alloc_bytes):
+    stats = _stage_stats(name)
+    stats['calls'] += 1
+    stats['seconds'] += seconds
+    stats['max_seconds'] = max(stats['max_seconds'], seconds)
+    stats['rows'] += rows or 0
+    stats['alloc_bytes'] += alloc_bytes
+
+def _rows(result):
+    if hasattr(result, 'height'):
+        return result.height
+    if isinstance(result, tuple) and result and hasattr(result[0], 'height'):
+        return result[0].height
+    return 0
+
+@contextmanager
+def stage(name, rows=0):
+    """Замер произвольного участка кода: with stage('plot'): ..."""
+    if not ENABLED:
+        yield
+        return
+    alloc_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        alloc = tracemalloc.get_traced_memory()[0] - alloc_before if tracemalloc.is_tracing() else 0
+        _record(name, time.perf_counter() - start, rows, alloc)
+
+def timed(name, rows=_rows):
+    """Декоратор стадии: время, обработанные строки (rows(result)) и аллокации за вызов"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            alloc_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            alloc = tracemalloc.get_traced_memory()[0] - alloc_before if tracemalloc.is_tracing() else 0
+            _record(name, seconds, rows(result), alloc)
+            return result
+        return wrapper
+    return decorator
+
+def collect(func, *args, **kwargs):
+    """Вызов в процессе-воркере пула со сбором статистики: (результат, статистика этого вызова).
+
+    spawn-воркер импортирует instrument заново с выключенным сбором, поэтому включаем его на время вызова,
+    а собранное возвращаем родителю для merge.
+    """
+    enable()
+    reset()
+    try:
+        return func(*args, **kwargs), report()
+    finally:
+        reset()
+        disable()
+
+def merge(stats):
+    """Добавляет статистику воркера (collect) к статистике этого процесса"""
+    for name, other in stats.items():
+        own = _stage_stats(name)
+        for key in ('calls', 'seconds', 'rows', 'alloc_bytes'):
+            own[key] += other[key]
+        own['max_seconds'] = max(own['max_seconds'], other['max_seconds'])
+        for counter, value in other['counters'].items():
+            own['counters'][counter] = own['counters'].get(counter, 0) + value
+
+def report():
+    """Сводка по стадиям, самые долгие первыми"""
+    return dict(sorted(STATS.items(), key=lambda item: item[1]['seconds'], reverse=True))
+
+def to_json(path=None):
+    data = json.dumps(report(), indent=2, ensure_ascii=False)
+    if path:
+        with open(path, 'w') as f:
+            f.write(data)
+    return data
@@ -0,0 +1,163 @@
+import os
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+
+import polars as pl
+
+def new_cache(max_entries=256, max_bytes=256 * 1024 * 1024, cache_dir=None,
+              max_disk_entries=4096, max_disk_bytes=1024 * 1024 * 1024):
+    """LRU кэш результатов: ограничен числом записей и суммарным размером фреймов; cache_dir - копия на диске
+    со своими лимитами (давно не использованные по mtime файлы удаляются)"""
+    disk = OrderedDict()
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        disk = _scan_disk(cache_dir)
+    return {
+        'entries': OrderedDict(), 'sizes': {}, 'bytes': 0,
+        'max_entries': max_entries, 'max_bytes': max_bytes, 'cache_dir': cache_dir,
+        # Файлы на диске: имя -> размер, от давно использованных к недавним
+        'disk': disk, 'disk_bytes': sum(disk.values()),
+        'max_disk_entries': max_disk_entries, 'max_disk_bytes': max_disk_bytes,
+        'hits': 0, 'misses': 0,
+        # Кэшем могут пользоваться потоки сервиса (server.py)
+        'lock': threading.Lock()
+    }
+
+def data_version(*frames):
+    """Отпечаток содержимого фреймов: другие даты или значения ряда дают другой ключ, старые записи просто не находятся"""
+    digest = hashlib.sha1()
+    for df in frames:
+        if df is None:
+            digest.update(b'none')
+            continue
+        for name in df.columns:
+            series = df[name]
+            digest.update(name.encode())
+            digest.update(series.to_numpy().tobytes() if series.dtype.is_numeric() or series.dtype.is_temporal()
+                          else '\x00'.join(map(str, series.to_list())).encode())
+    return digest.hexdigest()[:16]
+
+def make_key(series_id, method, params, *frames):
+    """Ключ записи: (id, метод, параметры, версия данных)"""
+    return (str(series_id), method, repr(params), data_version(*frames))
+
+def value_size(value):
+    if isinstance(value, pl.DataFrame):
+        return value.estimated_size()
+    if isinstance(value, dict):
+        return sum(value_size(item) for item in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(value_size(item) for item in value)
+    return 0
+
+def _disk_name(key):
+    return hashlib.sha1(repr(key).encode()).hexdigest() + '.pkl'
+
+def _scan_disk(cache_dir):
+    """Файлы кэша, оставшиеся от прошлых запусков, в порядке mtime"""
+    files = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.pkl'):
+            stat = os.stat(os.path.join(cache_dir, name))
+            files.append((stat.st_mtime, name, stat.st_size))
+    return OrderedDict((name, size) for _, name, size in sorted(files))
+
+def _touch_disk(cache, name):
+    """Отмечает использование файла (mtime - порядок LRU между запусками)"""
+    os.utime(os.path.join(cache['cache_dir'], name))
+    cache['disk'].move_to_end(name)
+
+def _add_disk(cache, name, size):
+    if name in cache['disk']:
+        cache['disk_bytes'] -= cache['disk'].pop(name)
+    cache['disk'][name] = size
+    cache['disk_bytes'] += size
+    # Версии данных входят в ключ: без лимита каждое изменение ряда оставляло бы новый файл навсегда
+    while len(cache['disk']) > cache['max_disk_entries'] or cache['disk_bytes'] > cache['max_disk_bytes']:
+        old_name, old_size = cache['disk'].popitem(last=False)
+        cache['disk_bytes'] -= old_size
+        try:
+            os.remove(os.path.join(cache['cache_dir'], old_name))
+        except FileNotFoundError:
+            pass
+
+def _store(cache, key, value):
+    size = value_size(value)
+    if size > cache['max_bytes']:
+        return
+    cache['entries'][key] = value
+    cache['sizes'][key] = size
+    cache['bytes'] += size
+    # Вытесняем самые давно использованные записи, пока не влезаем в оба лимита
+    while len(cache['entries']) > cache['max_entries'] or cache['bytes'] > cache['max_bytes']:
+        old_key, _ = cache['entries'].popitem(last=False)
+        cache['bytes'] -= cache['sizes'].pop(old_key)
+
+def cache_get(cache, key):
+    """Значение по ключу или None; попадание поднимает запись в начало очереди LRU"""
+    with cache['lock']:
+        return _get(cache, key)
+
+def _get(cache, key):
+    if key in cache['entries']:
+        cache['entries'].move_to_end(key)
+        cache['hits'] += 1
+        return cache['entries'][key]
+
+    if cache['cache_dir']:
+        name = _disk_name(key)
+        path = os.path.join(cache['cache_dir'], name)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            _store(cache, key, value)
+            _add_disk(cache, name, os.path.getsize(path))
+            _touch_disk(cache, name)
+            cache['hits'] += 1
+            return value
+
+    cache['misses'] += 1
+    return None
+
+def cache_put(cache, key, value):
+    with cache['lock']:
+        return _put(cache, key, value)
+
+def _put(cache, key, value):
+    if key in cache['entries']:
+        cache['bytes'] -= cache['sizes'].pop(key)
+        del cache['entries'][key]
+    _store(cache, key, value)
+
+    if cache['cache_dir']:
+        name = _disk_name(key)
+        path = os.path.join(cache['cache_dir'], name)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(value, f)
+        os.replace(path + '.tmp', path)
+        _add_disk(cache, name, os.path.getsize(path))
+    return value
+
+def cache_clear(cache, disk=False):
+    with cache['lock']:
+        _clear(cache, disk)
+
+def _clear(cache, disk):
+    cache['entries'].clear()
+    cache['sizes'].clear()
+    cache['bytes'] = 0
+    cache['hits'] = cache['misses'] = 0
+    if disk and cache['cache_dir']:
+        for name in os.listdir(cache['cache_dir']):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(cache['cache_dir'], name))
+        cache['disk'].clear()
+        cache['disk_bytes'] = 0
+
+def cache_info(cache):
+    return {key: cache[key] for key in ('hits', 'misses', 'bytes', 'max_entries', 'max_bytes', 'cache_dir',
+                                        'disk_bytes', 'max_disk_entries', 'max_disk_bytes')} | {
+        'entries': len(cache['entries']), 'disk_entries': len(cache['disk'])
+    }
@@ -0,0 +1,36 @@
+from methods import linear, polynomial, spline, log
+from methods.grid import build_grid, to_frame
+
+# Ядра работают с уже подготовленной сеткой build_grid: kernel(grid) -> массив значений по дням
+KERNELS = {
+    'linear': linear.fill,
+    'polynomial': polynomial.fill,
+    'spline': spline.fill,
+    'log': log.fill
+}
+
+METHODS = {
+    'linear': linear.interpolate,
+    'polynomial': polynomial.interpolate,
+    'spline': spline.interpolate,
+    'log': log.interpolate
+}
+
+# Встроенные методы есть в каждом процессе; register_method добавляет метод только в текущий,
+# воркеры spawn заново импортируют methods и его не видят
+BUILTIN_METHODS = frozenset(METHODS)
+
+# Методы, которые заполняют сразу все ряды LazyFrame внутри движка Polars
+FRAME_METHODS = {
+    'linear': linear.interpolate_frame,
+    'log': log.interpolate_frame
+}
+
+def run_kernel(kernel, df):
+    grid = build_grid(df)
+    return to_frame(grid, kernel(grid))
+
+def register_method(name, kernel):
+    """Подключает новый метод: достаточно ядра kernel(grid) -> массив значений по дням"""
+    KERNELS[name] = kernel
+    METHODS[name] = lambda df: run_kernel(kernel, df)
@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+import numpy as np
+import polars as pl
+
+import instrument
+from instrument import timed
+from data_utils import float_values
+
+@timed("grid", rows=lambda grid: len(grid['values']))
+def build_grid(df):
+    """Общая подготовка ряда для всех методов: плотная дневная сетка, маска известных точек и их индексы"""
+    days = df["date"].dt.date()
+    start = days.min()
+    offsets = (days - start).dt.total_days().to_numpy()
+
+    values = np.full(offsets.max() + 1, np.nan)
+    values[offsets] = df.select(float_values(df)).to_series().to_numpy()
+    mask = ~np.isnan(values)
+
+    if instrument.ENABLED:
+        instrument.count("grid", "missing_days", int((~mask).sum()))
+        # Пропуск - непрерывная серия отсутствующих дней
+        instrument.count("grid", "gaps", int(np.count_nonzero(np.diff(mask.astype(np.int8)) == -1)))
+
+    return {
+        'id': df["id"][0],
+        'start': start,
+        'values': values,
+        'mask': mask,
+        'x_known': np.flatnonzero(mask),
+        'x_missing': np.flatnonzero(~mask)
+    }
+
+def to_frame(grid, values):
+    """Собирает результат ядра обратно в фрейм id/date/value"""
+    return pl.DataFrame({
+        "id": pl.repeat(grid['id'], len(values), dtype=pl.String, eager=True),
+        "date": pl.date_range(grid['start'], grid['start'] + timedelta(days=len(values) - 1), interval="1d", eager=True),
+        "value": values.astype(int)
+    })
+
+def upsample_daily(lf):
+    """Ленивая дневная сетка сразу для всех рядов: id/date/value с null в пропущенных днях"""
+    # Компактные данные (Categorical id, Float32) приводятся к общей схеме результатов
+    lf = lf.select([pl.col("id").cast(pl.String), pl.col("date").dt.date(), float_values(lf)])
+    days = (
+        lf.group_by("id", maintain_order=True)
+        .agg(pl.date_range(pl.col("date").min(), pl.col("date").max(), interval="1d").alias("date"))
+        .explode("date")
+    )
+    return days.join(lf, on=["id", "date"], how="left", maintain_order="left")
+
+def count_gaps(lf):
+    """Счётчики grid (missing_days, gaps) по дневной сетке upsample_daily, как у build_grid.
+
+    Без instrument план остаётся ленивым; со включённым сетка считается сразу, чтобы посчитать null.
+    """
+    if not instrument.ENABLED:
+        return lf
+    df = lf.collect()
+    missing = pl.col("value").is_null()
+    counts = df.select(
+        missing.sum().alias("missing_days"),
+        # Пропуск - непрерывная серия отсутствующих дней внутри ряда
+        (missing & ~missing.shift(1, fill_value=False).over("id")).sum().alias("gaps")
+    ).row(0, named=True)
+    for counter, value in counts.items():
+        instrument.count("grid", counter, int(value))
+    return df.lazy()
+
+def collected(lf):
+    """С instrument план ядра выполняется внутри его стадии timed, иначе остаётся ленивым"""
+    return lf.collect().lazy() if instrument.ENABLED else lf
+
+def frame_rows(lf):
+    return lf.select(pl.len()).collect().item()
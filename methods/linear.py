@@ -1,19 +1,23 @@
-import polars as pl
 import numpy as np
+import polars as pl
+
+from methods.grid import upsample_daily, count_gaps, collected, frame_rows
+from instrument import timed
+
+@timed("kernel_linear", rows=len)
+def fill(grid):
+    values = grid['values'].copy()
+    x_known = grid['x_known']
+    if len(x_known) > 1:
+        values[grid['x_missing']] = np.interp(grid['x_missing'], x_known, values[x_known])
+    return values
+
+@timed("kernel_linear", rows=frame_rows)
+def interpolate_frame(lf):
+    """Заполнение всех рядов LazyFrame выражениями Polars, без выхода в NumPy"""
+    return collected(count_gaps(upsample_daily(lf)).with_columns(
+        pl.col("value").interpolate().over("id").cast(pl.Int64, strict=False).alias("value")
+    ))
 
 def interpolate(df):
-    df = df.with_columns(pl.col("date").dt.date())
-    date_range = pl.date_range(df["date"].min(), df["date"].max(), interval="1d", eager=True)
-    
-    full_df = pl.DataFrame({"date": date_range})
-    merged = full_df.join(df, on="date", how="left")
-    
-    values = merged["value"].to_numpy()
-    mask = ~np.isnan(values)
-    if mask.sum() > 1:
-        values[~mask] = np.interp(np.where(~mask)[0], np.where(mask)[0], values[mask])
-    
-    return merged.with_columns([
-        pl.lit(values.astype(int)).alias("value"),
-        pl.lit(df["id"][0]).alias("id")
-    ]).select(["id", "date", "value"])
\ No newline at end of file
+    return interpolate_frame(df.lazy()).collect()
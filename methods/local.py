@@ -0,0 +1,58 @@
+import numpy as np
+
+def moment_polyfit(t, y, weights, order, reduce, fitted=None):
+    """Коэффициенты (по возрастанию степени) взвешенных полиномов order для пачки подгонок одним solve.
+
+    reduce(v) суммирует значения по каждой подгонке: сумма по строкам 2D-массива или np.bincount по группам.
+    Нормальные уравнения из моментов sum(w * t^k) - матрица Ганкеля, без матрицы Вандермонда.
+    fitted - маска подгонок, которые решаются; у остальных коэффициенты NaN.
+    """
+    term = weights
+    moments, rhs = [], []
+    for k in range(2 * order + 1):
+        moments.append(reduce(term))
+        if k <= order:
+            rhs.append(reduce(term * y))
+        term = term * t
+    moments = np.stack(moments, axis=1)
+    rhs = np.stack(rhs, axis=1)
+    if fitted is None:
+        fitted = np.ones(len(moments), dtype=bool)
+
+    coef = np.full((len(moments), order + 1), np.nan)
+    lhs = moments[fitted][:, np.add.outer(np.arange(order + 1), np.arange(order + 1))]
+    coef[fitted] = np.linalg.solve(lhs, rhs[fitted][:, :, None])[:, :, 0]
+    return coef
+
+def local_polyfit(grid, order, window):
+    """Значения во всех пропусках по локальным полиномам степени order.
+
+    Каждый пропущенный день подгоняется только по window известным точкам слева и справа, все пропуски
+    решаются одним пакетным вызовом: стоимость O(длина ряда), а не глобальная подгонка по всем точкам.
+    """
+    x_known = grid['x_known']
+    x_missing = grid['x_missing']
+    y_known = grid['values'][x_known]
+    if len(x_missing) == 0:
+        return np.empty(0)
+
+    # Соседи каждого пропуска: window известных точек до него и window после
+    position = np.searchsorted(x_known, x_missing)
+    neighbours = position[:, None] + np.arange(-window, window)
+    valid = (neighbours >= 0) & (neighbours < len(x_known))
+    neighbours = np.clip(neighbours, 0, len(x_known) - 1)
+
+    # Центрируем на пропуске и нормируем расстояния: свободный член полинома и есть значение в пропуске
+    offsets = (x_known[neighbours] - x_missing[:, None]).astype(float)
+    offsets /= np.abs(offsets).max(axis=1, keepdims=True)
+    offsets[~valid] = 0.0
+    weights = valid.astype(float)
+
+    filled = np.interp(x_missing, x_known, y_known)
+    solvable = valid.sum(axis=1) > order
+    if solvable.any():
+        filled[solvable] = moment_polyfit(
+            offsets[solvable], y_known[neighbours[solvable]], weights[solvable], order, lambda v: v.sum(axis=1)
+        )[:, 0]
+    # Где соседей не хватает на полином, остаётся линейная интерполяция
+    return filled
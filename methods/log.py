@@ -1,33 +1,55 @@
-import polars as pl
 import numpy as np
+import polars as pl
 
-def interpolate(df):
-    df = df.with_columns(pl.col("date").dt.date())
-    date_range = pl.date_range(df["date"].min(), df["date"].max(), interval="1d", eager=True)
-    
-    full_df = pl.DataFrame({"date": date_range})
-    merged = full_df.join(df, on="date", how="left")
-    
-    values = merged["value"].to_numpy()
-    mask = ~np.isnan(values)
+from methods.grid import upsample_daily, count_gaps, collected, frame_rows
+from instrument import timed
+
+@timed("kernel_log", rows=len)
+def fill(grid, shift=None):
+    values = grid['values'].copy()
+    mask = grid['mask']
     
-    # Ensure positive values for log
-    if np.any(values[mask] <= 0):
+    # Ensure positive values for log (shift can be forced when only part of the series is refitted)
+    if shift is None:
+        shift = np.any(values[mask] <= 0)
+    if shift:
         values[mask] = values[mask] + 1
         shift_applied = True
     else:
         shift_applied = False
     
     if mask.sum() > 1:
-        log_values = np.log(values[mask])
-        x_known = np.where(mask)[0]
-        log_interp = np.interp(np.where(~mask)[0], x_known, log_values)
+        x_known = grid['x_known']
+        log_interp = np.interp(grid['x_missing'], x_known, np.log(values[mask]))
         values[~mask] = np.exp(log_interp)
     
     if shift_applied:
         values = np.clip(values - 1, 0, None)
     
-    return merged.with_columns([
-        pl.lit(values.astype(int)).alias("value"),
-        pl.lit(df["id"][0]).alias("id")
-    ]).select(["id", "date", "value"])
\ No newline at end of file
+    return values
+
+@timed("kernel_log", rows=frame_rows)
+def interpolate_frame(lf, shift=None):
+    """Заполнение всех рядов LazyFrame выражениями Polars, без выхода в NumPy.
+
+    shift - фрейм id/shift, задающий сдвиг по id (когда пересчитывается только часть ряда).
+    """
+    # Same shift-by-one as fill(): applied per id when any known value is not positive
+    shifted = pl.col("value") + pl.col("shift").cast(pl.Float64)
+    filled = pl.coalesce(shifted, shifted.log().interpolate().exp().over("id"))
+    lf = count_gaps(upsample_daily(lf))
+    if shift is None:
+        lf = lf.with_columns((pl.col("value") <= 0).any().over("id").alias("shift"))
+    else:
+        lf = lf.join(shift.lazy().select(["id", "shift"]), on="id", how="left", maintain_order="left")
+    return collected(
+        lf
+        .with_columns(
+            pl.when(pl.col("shift")).then((filled - 1).clip(lower_bound=0)).otherwise(filled)
+            .cast(pl.Int64, strict=False).alias("value")
+        )
+        .drop("shift")
+    )
+
+def interpolate(df):
+    return interpolate_frame(df.lazy()).collect()
@@ -1,23 +1,23 @@
-import polars as pl
 import numpy as np
 
-def interpolate(df, order=2):
-    df = df.with_columns(pl.col("date").dt.date())
-    date_range = pl.date_range(df["date"].min(), df["date"].max(), interval="1d", eager=True)
-    
-    full_df = pl.DataFrame({"date": date_range})
-    merged = full_df.join(df, on="date", how="left")
-    
-    values = merged["value"].to_numpy()
-    mask = ~np.isnan(values)
-    if mask.sum() > order + 1:
-        x_known = np.where(mask)[0]
-        y_known = values[mask]
-        poly_coef = np.polyfit(x_known, y_known, order)
-        values[~mask] = np.polyval(poly_coef, np.where(~mask)[0])
+from methods.grid import build_grid, to_frame
+from methods.local import local_polyfit
+from instrument import timed
+
+@timed("kernel_polynomial", rows=len)
+def fill(grid, order=2, window=None):
+    values = grid['values'].copy()
+    x_known = grid['x_known']
+    if window:
+        # Local fit from `window` known points on each side of every gap
+        values[grid['x_missing']] = local_polyfit(grid, order, window)
+        values = np.clip(values, 0, None)
+    elif len(x_known) > order + 1:
+        poly_coef = np.polyfit(x_known, values[x_known], order)
+        values[grid['x_missing']] = np.polyval(poly_coef, grid['x_missing'])
         values = np.clip(values, 0, None)
-    
-    return merged.with_columns([
-        pl.lit(values.astype(int)).alias("value"),
-        pl.lit(df["id"][0]).alias("id")
-    ]).select(["id", "date", "value"])
\ No newline at end of file
+    return values
+
+def interpolate(df, order=2, window=None):
+    grid = build_grid(df)
+    return to_frame(grid, fill(grid, order, window))
@@ -1,29 +1,32 @@
-import polars as pl
 import numpy as np
-from scipy import interpolate as scipy_interp
 
-def interpolate(df, order=3):
-    df = df.with_columns(pl.col("date").dt.date())
-    date_range = pl.date_range(df["date"].min(), df["date"].max(), interval="1d", eager=True)
-    
-    full_df = pl.DataFrame({"date": date_range})
-    merged = full_df.join(df, on="date", how="left")
-    
-    values = merged["value"].to_numpy()
-    mask = ~np.isnan(values)
+from methods.grid import build_grid, to_frame
+from methods.local import local_polyfit
+from instrument import timed
+
+@timed("kernel_spline", rows=len)
+def fill(grid, order=3, window=None):
+    values = grid['values'].copy()
+    x_known = grid['x_known']
+    x_missing = grid['x_missing']
     
-    if mask.sum() < order + 1:
+    if window:
+        # Local cubic through the `window` nearest known points on each side (window=2 - 4-point cubic)
+        values[x_missing] = local_polyfit(grid, order, window)
+        values = np.clip(values, 0, None)
+    elif len(x_known) < order + 1:
         # Fallback to linear interpolation
-        if mask.sum() > 1:
-            values[~mask] = np.interp(np.where(~mask)[0], np.where(mask)[0], values[mask])
+        if len(x_known) > 1:
+            values[x_missing] = np.interp(x_missing, x_known, values[x_known])
     else:
-        x_known = np.where(mask)[0]
-        y_known = values[mask]
-        spline = scipy_interp.UnivariateSpline(x_known, y_known, s=0, k=min(order, len(x_known)-1))
-        values[~mask] = spline(np.where(~mask)[0])
+        # scipy нужен только здесь: импорт при первой сплайн-подгонке, а не при импорте methods
+        from scipy.interpolate import UnivariateSpline
+        spline = UnivariateSpline(x_known, values[x_known], s=0, k=min(order, len(x_known)-1))
+        values[x_missing] = spline(x_missing)
         values = np.clip(values, 0, None)
     
-    return merged.with_columns([
-        pl.lit(values.astype(int)).alias("value"),
-        pl.lit(df["id"][0]).alias("id")
-    ]).select(["id", "date", "value"])
\ No newline at end of file
+    return values
+
+def interpolate(df, order=3, window=None):
+    grid = build_grid(df)
+    return to_frame(grid, fill(grid, order, window))
@@ -0,0 +1,42 @@
+import numpy as np
+import polars as pl
+
+def load_outages(path='data/outages.csv'):
+    """Календарь системных сбоев из CSV start,end (даты включительно); пересекающиеся интервалы сливаются"""
+    outages = (
+        pl.read_csv(path, schema={'start': pl.String, 'end': pl.String})
+        .select([pl.col("start").str.to_date("%Y-%m-%d"), pl.col("end").str.to_date("%Y-%m-%d")])
+        .sort("start")
+    )
+    # Новый интервал начинается, когда start дальше всех предыдущих end (соседние дни тоже сливаются)
+    return (
+        outages.with_columns(
+            (pl.col("start") > pl.col("end").cum_max().shift(1) + pl.duration(days=1))
+            .fill_null(True).cum_sum().alias("group")
+        )
+        .group_by("group", maintain_order=True)
+        .agg([pl.col("start").min(), pl.col("end").max()])
+        .drop("group")
+    )
+
+def outage_mask(dates, outages):
+    """Булева маска дат, попадающих в сбои: бинарный поиск по отсортированным интервалам, без разворота по дням"""
+    days = dates.dt.date().to_numpy().astype('datetime64[D]').astype(np.int64)
+    starts = outages["start"].to_numpy().astype('datetime64[D]').astype(np.int64)
+    ends = outages["end"].to_numpy().astype('datetime64[D]').astype(np.int64)
+
+    if len(starts) == 0:
+        return pl.Series("outage", np.zeros(len(days), dtype=bool))
+
+    # Ближайший интервал, начавшийся не позже даты; дата внутри, если не позже его конца
+    position = np.searchsorted(starts, days, side='right') - 1
+    inside = (position >= 0) & (days <= ends[np.clip(position, 0, None)])
+    return pl.Series("outage", inside)
+
+def drop_outages(data, outages, column="date"):
+    """Убирает наблюдения внутри сбоев: дальше они заполняются как обычные пропуски"""
+    return data.filter(~outage_mask(data[column], outages))
+
+def flag_outages(data, outages, column="date"):
+    """Добавляет колонку outage: день попадает в окно сбоя"""
+    return data.with_columns(outage_mask(data[column], outages))
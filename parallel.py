@@ -0,0 +1,99 @@
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import polars as pl
+
+import instrument
+from methods import METHODS, BUILTIN_METHODS
+from auto_select import select_best_method
+from data_utils import lookup_series
+
+RESULT_SCHEMA = {"id": pl.String, "date": pl.Date, "value": pl.Int64, "method": pl.String}
+
+def to_arrow_bytes(df):
+    buf = io.BytesIO()
+    df.write_ipc(buf)
+    return buf.getvalue()
+
+def from_arrow_bytes(data):
+    return pl.read_ipc(io.BytesIO(data))
+
+def make_payloads(index, series_ids, workers, chunk_size=None):
+    """Делит ряды на пачки и упаковывает каждую в один Arrow-буфер для передачи воркерам"""
+    series_ids = [str(i) for i in series_ids if str(i) in index['offsets']]
+    if chunk_size is None:
+        # Несколько пачек на воркер, чтобы длинные ряды не перекашивали нагрузку
+        chunk_size = max(1, len(series_ids) // (workers * 4))
+    return [
+        to_arrow_bytes(pl.concat([lookup_series(index, i) for i in series_ids[start:start + chunk_size]]))
+        for start in range(0, len(series_ids), chunk_size)
+    ]
+
+def process_pool(workers):
+    # spawn: fork из многопоточного процесса Polars может зависнуть
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def in_workers(method):
+    """Можно ли считать метод в пуле процессов: подключённые register_method методы есть только в этом процессе"""
+    return method == 'auto' or method in BUILTIN_METHODS
+
+def pooled_result(result, stats):
+    """Результат задачи пула: при stats - пара (результат, статистика воркера), статистика добавляется к своей"""
+    if not stats:
+        return result
+    result, worker_stats = result
+    instrument.merge(worker_stats)
+    return result
+
+def run_chunk(payload, method, skip_errors=False, options=None, stats=False):
+    """Обрабатывает пачку рядов одним методом; данные приходят и уходят Arrow-буфером.
+
+    options - параметры методов по имени, например {'spline': {'window': 2}}.
+    stats=True - в воркере пула при включённом instrument: вернуть ещё статистику воркера (см. pooled_result).
+    """
+    if stats:
+        return instrument.collect(run_chunk, payload, method, skip_errors, options)
+    options = options or {}
+    results = []
+    for original_data in from_arrow_bytes(payload).partition_by("id", maintain_order=True):
+        used_method = select_best_method(original_data)['method'] if method == 'auto' else method
+        try:
+            interpolated_data = METHODS[used_method](original_data, **options.get(used_method, {}))
+        except Exception:
+            if not skip_errors:
+                raise
+            continue
+        results.append(interpolated_data.with_columns(pl.lit(used_method).alias("method")))
+
+    return to_arrow_bytes(pl.concat(results)) if results else None
+
+def run_tasks(index, series_ids, methods, workers=1, chunk_size=None, skip_errors=False, options=None):
+    """Раскидывает задачи (пачка рядов, метод) по пулу процессов и собирает результат в один фрейм.
+
+    Порядок результата не зависит от числа воркеров: методы по порядку, внутри метода ряды по порядку series_ids.
+    """
+    workers = workers or os.cpu_count()
+    payloads = make_payloads(index, series_ids, workers, chunk_size)
+    tasks = [(payload, method) for method in methods for payload in payloads]
+
+    pooled = [i for i, (_, method) in enumerate(tasks) if in_workers(method)]
+    chunks = {}
+    if workers > 1 and len(pooled) > 1:
+        stats = instrument.ENABLED
+        with process_pool(min(workers, len(pooled))) as executor:
+            chunks = {i: pooled_result(result, stats) for i, result in zip(pooled, executor.map(
+                run_chunk, [tasks[i][0] for i in pooled], [tasks[i][1] for i in pooled],
+                [skip_errors] * len(pooled), [options] * len(pooled), [stats] * len(pooled)
+            ))}
+    # Подключённые методы (и всё при workers=1) считаются здесь же
+    chunks = [
+        chunks[i] if i in chunks else run_chunk(payload, method, skip_errors, options)
+        for i, (payload, method) in enumerate(tasks)
+    ]
+
+    results = [from_arrow_bytes(chunk) for chunk in chunks if chunk is not None]
+    if not results:
+        return pl.DataFrame(schema=RESULT_SCHEMA)
+    return pl.concat(results)
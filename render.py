@@ -0,0 +1,111 @@
+import os
+
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_pdf import PdfPages
+
+import instrument
+from methods import KERNELS, build_grid, to_frame
+from downsample import to_plot_arrays
+from parallel import make_payloads, process_pool, from_arrow_bytes, in_workers, pooled_result
+
+PASTEL_COLORS = ["lightcoral", "lightgreen", "lightsalmon", "plum"]
+
+def create_compare_figure(methods):
+    """Сетка сравнения 2x2 без pyplot: Figure рисуется через Agg, линии потом только обновляются"""
+    fig = Figure(figsize=(15, 10))
+    axes = fig.subplots(2, 2).flatten()
+    lines = {}
+    for i, method in enumerate(methods[:4]):
+        ax = axes[i]
+        ax.xaxis_date()
+        # Исходные данные - тонкая линия, интерполяция - полупрозрачная пастельная
+        original_line, = ax.plot([], [], "-", color='darkblue', alpha=1.0, linewidth=1.5, label="Исходные")
+        result_line, = ax.plot([], [], "-", color=PASTEL_COLORS[i], alpha=0.6, linewidth=4, label=method)
+        ax.set_title(method)
+        ax.legend(loc="upper left")
+        ax.grid(True, alpha=0.3)
+        lines[method] = (original_line, result_line)
+    for ax in axes[len(lines):]:
+        ax.set_visible(False)
+    fig.subplots_adjust(left=0.05, right=0.98, bottom=0.05, top=0.92, hspace=0.25, wspace=0.12)
+    return {'figure': fig, 'lines': lines, 'title': fig.suptitle("", fontsize=14)}
+
+def draw_compare(canvas, original_data, results, series_id, max_points=750):
+    """Подставляет данные ряда в уже созданные линии вместо создания новой фигуры"""
+    original_x, original_y = to_plot_arrays(original_data, max_points)
+    for method, (original_line, result_line) in canvas['lines'].items():
+        ax = original_line.axes
+        result = results.get(method)
+        ax.set_visible(result is not None)
+        if result is None:
+            continue
+        result_x, result_y = to_plot_arrays(result, max_points)
+        original_line.set_data(mdates.date2num(original_x), original_y)
+        result_line.set_data(mdates.date2num(result_x), result_y)
+        ax.relim()
+        ax.autoscale_view()
+    canvas['title'].set_text(f"Сравнение методов - Серия {series_id}")
+    return canvas['figure']
+
+def compute_results(original_data, methods, options=None):
+    options = options or {}
+    grid = build_grid(original_data)
+    results = {}
+    for method in methods:
+        try:
+            results[method] = to_frame(grid, KERNELS[method](grid, **options.get(method, {})))
+        except Exception:
+            results[method] = None
+    return results
+
+def render_chunk(payload, out_dir, fmt='png', methods=None, options=None, max_points=750, stats=False):
+    """Рисует пачку рядов в файлы series_{id}_compare.{fmt}, переиспользуя одну фигуру.
+
+    stats=True - в воркере пула при включённом instrument: вернуть ещё статистику воркера.
+    """
+    if stats:
+        return instrument.collect(render_chunk, payload, out_dir, fmt, methods, options, max_points)
+    methods = methods or list(KERNELS)
+    canvas = create_compare_figure(methods)
+    paths = []
+    for original_data in from_arrow_bytes(payload).partition_by("id", maintain_order=True):
+        series_id = original_data["id"][0]
+        fig = draw_compare(canvas, original_data, compute_results(original_data, methods, options), series_id, max_points)
+        path = os.path.join(out_dir, f'series_{series_id}_compare.{fmt}')
+        fig.savefig(path)
+        paths.append(path)
+    return paths
+
+def render_batch(index, series_ids, out_dir='data/reports', fmt='png', workers=1, options=None, max_points=750):
+    """Сетки сравнения методов для многих рядов без GUI.
+
+    png/svg - файл на ряд, пачки рядов рисуются параллельно в пуле процессов.
+    pdf - один многостраничный файл out_dir/compare.pdf, страницы пишутся последовательно.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    payloads = make_payloads(index, series_ids, workers)
+    methods = list(KERNELS)
+
+    if fmt == 'pdf':
+        path = os.path.join(out_dir, 'compare.pdf')
+        canvas = create_compare_figure(methods)
+        with PdfPages(path) as pdf:
+            for payload in payloads:
+                for original_data in from_arrow_bytes(payload).partition_by("id", maintain_order=True):
+                    results = compute_results(original_data, methods, options)
+                    pdf.savefig(draw_compare(canvas, original_data, results, original_data["id"][0], max_points))
+        return [path]
+
+    # Подключённых через register_method методов в воркерах нет - тогда рисуем здесь же
+    if workers > 1 and len(payloads) > 1 and all(map(in_workers, methods)):
+        stats = instrument.ENABLED
+        with process_pool(min(workers, len(payloads))) as executor:
+            chunks = executor.map(
+                render_chunk, payloads, [out_dir] * len(payloads), [fmt] * len(payloads),
+                [methods] * len(payloads), [options] * len(payloads), [max_points] * len(payloads),
+                [stats] * len(payloads)
+            )
+            return [path for chunk in chunks for path in pooled_result(chunk, stats)]
+    return [path for payload in payloads for path in render_chunk(payload, out_dir, fmt, methods, options, max_points)]
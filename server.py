@@ -0,0 +1,261 @@
+# %% TSDS - локальный сервис интерполяции: данные загружаются один раз и живут в памяти процесса
+# python server.py --port 8765            (HTTP на 127.0.0.1)
+# python server.py --socket /tmp/tsds.sock (HTTP поверх Unix сокета)
+#
+# GET /series?min_days=30                  список рядов
+# GET /interpolate?id=...&method=auto      один ряд
+# GET /select?ids=1,2,3                    автовыбор метода
+# GET /batch?method=auto&ids=...&chunk=200 все ряды потоком NDJSON (chunked)
+# GET /stats                               память, кэш результатов, число запросов
+import os
+import sys
+import json
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+
+import core
+import instrument
+from memo import make_key, cache_get, cache_put
+from parallel import process_pool, run_chunk, pooled_result, in_workers, to_arrow_bytes, from_arrow_bytes, make_payloads
+
+REQUESTS = {'total': 0, 'coalesced': 0, 'errors': 0}
+# Потоки - для дешёвых векторных запросов (списки, выбор метода, подготовка пачек)
+EXECUTOR = ThreadPoolExecutor(4)
+# Подгонки (циклы по рядам на Python, сплайны) - в процессах: в потоках они упираются в GIL
+PROCESSES = None
+# Одинаковые запросы в полёте ждут один и тот же результат вместо повторного расчёта
+INFLIGHT = {}
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+def _ids(query):
+    ids = query.get('ids')
+    return ids.split(',') if ids else None
+
+def _series_id(query):
+    if 'id' not in query:
+        raise ValueError("нужен параметр id")
+    if str(query['id']) not in core.series_index['offsets']:
+        raise ValueError(f"ряд {query['id']} не найден")
+    return query['id']
+
+def handle_series(query):
+    return core.get_series_list(int(query.get('min_days', 0))).write_json()
+
+def _method(query, extra=('auto',)):
+    method = query.get('method', 'auto')
+    if method not in core.METHODS and method not in extra:
+        raise ValueError(f"неизвестный метод {method}")
+    return method
+
+def processes():
+    global PROCESSES
+    if PROCESSES is None:
+        PROCESSES = process_pool(os.cpu_count())
+    return PROCESSES
+
+def executor_for(method):
+    """Пул для подгонки: подключённых через register_method методов нет в процессах-воркерах"""
+    return processes() if in_workers(method) else EXECUTOR
+
+async def fit_chunk(payload, method):
+    """run_chunk в пуле; статистика instrument из процессов-воркеров добавляется к статистике сервиса"""
+    stats = instrument.ENABLED and in_workers(method)
+    result = await asyncio.get_running_loop().run_in_executor(
+        executor_for(method), run_chunk, payload, method, False, None, stats
+    )
+    return pooled_result(result, stats)
+
+async def handle_interpolate(query):
+    """Один ряд: ответ из кэша результатов core, при промахе подгонка в пуле процессов"""
+    series_id = _series_id(query)
+    method = _method(query)
+    original_data = core.lookup_series(core.series_index, series_id)
+    # Тот же ключ, что у core.interpolate_series: кэш общий для сервиса и прямых вызовов
+    key = make_key(series_id, method, None, original_data.drop("id"), None)
+    cached = cache_get(core.result_cache, key)
+    if cached is None:
+        result = from_arrow_bytes(await fit_chunk(to_arrow_bytes(original_data), method))
+        cached = cache_put(core.result_cache, key, (result.drop("method"), result["method"][0]))
+    interpolated_data, used_method = cached
+    return json.dumps({'id': series_id, 'method': used_method, 'data': json.loads(interpolated_data.write_json())})
+
+def handle_select(query):
+    return core.select_methods(_ids(query)).write_json()
+
+def handle_stats(query):
+    return json.dumps({
+        'memory': core.get_memory_report(), 'cache': core.get_cache_info(), 'requests': dict(REQUESTS)
+    }, default=str)
+
+HANDLERS = {
+    '/series': handle_series,
+    '/interpolate': handle_interpolate,
+    '/select': handle_select,
+    '/stats': handle_stats
+}
+
+def _batch_chunks(query):
+    """Проверка параметров /batch до отправки заголовков: ошибка здесь - обычный ответ 400"""
+    _method(query, ('auto', 'measured'))
+    try:
+        chunk = int(query.get('chunk', 200))
+    except ValueError:
+        chunk = 0
+    if chunk <= 0:
+        raise ValueError("chunk должен быть положительным целым")
+    series_ids = _ids(query) or list(core.series_index['offsets'])
+    return [series_ids[start:start + chunk] for start in range(0, len(series_ids), chunk)]
+
+def _batch_tasks(series_ids, method):
+    """Пачка /batch -> задачи (Arrow-буфер рядов, метод); автовыбор векторный, как в core.interpolate_batch"""
+    index = core.series_index
+    if method not in ('auto', 'measured'):
+        return [(payload, method) for payload in make_payloads(index, series_ids, 1, len(series_ids))]
+    selection = core.select_methods(series_ids, measured=method == 'measured')
+    return [
+        (payload, method_name)
+        for (method_name,), group in selection.partition_by("method", as_dict=True, maintain_order=True).items()
+        for payload in make_payloads(index, group["id"].to_list(), 1, group.height)
+    ]
+
+async def _batch_chunk(series_ids, method):
+    loop = asyncio.get_running_loop()
+    tasks = await loop.run_in_executor(EXECUTOR, _batch_tasks, series_ids, method)
+    chunks = await asyncio.gather(*(fit_chunk(payload, method_name) for payload, method_name in tasks))
+    results = [from_arrow_bytes(chunk) for chunk in chunks if chunk is not None]
+    if not results:
+        return b''
+    return pl.concat(results).with_columns(pl.col("date").cast(pl.Date)).write_ndjson().encode()
+
+async def write_response(writer, status, body, content_type='application/json'):
+    body = body.encode() if isinstance(body, str) else body
+    writer.write(
+        f"HTTP/1.1 {status} {STATUS[status]}\r\nContent-Type: {content_type}; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+async def run(handler, query):
+    """Ответ обработчика (async - сам отправляет подгонки в процессы, обычный - в пуле потоков);
+    повторный такой же запрос присоединяется к уже идущему расчёту"""
+    key = (handler.__name__, tuple(sorted(query.items())))
+    if key in INFLIGHT:
+        REQUESTS['coalesced'] += 1
+        return await asyncio.shield(INFLIGHT[key])
+
+    if asyncio.iscoroutinefunction(handler):
+        future = asyncio.ensure_future(handler(query))
+    else:
+        future = asyncio.get_running_loop().run_in_executor(EXECUTOR, handler, query)
+    INFLIGHT[key] = future
+    try:
+        return await future
+    finally:
+        del INFLIGHT[key]
+
+async def stream_batch(writer, query):
+    """Отдаёт /batch по частям: каждая пачка рядов считается в пуле и сразу уходит клиенту"""
+    try:
+        chunks = _batch_chunks(query)
+    except ValueError as e:
+        REQUESTS['errors'] += 1
+        await write_response(writer, 400, json.dumps({'error': str(e)}, ensure_ascii=False))
+        return
+    method = query.get('method', 'auto')
+    # Следующие пачки считаются, пока предыдущая уходит клиенту; вперёд не больше числа процессов
+    pending = [asyncio.ensure_future(_batch_chunk(series_ids, method)) for series_ids in chunks[:os.cpu_count()]]
+    chunks = chunks[len(pending):]
+    writer.write(
+        b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson; charset=utf-8\r\n"
+        b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+    )
+    try:
+        while pending:
+            data = await pending.pop(0)
+            if chunks:
+                pending.append(asyncio.ensure_future(_batch_chunk(chunks.pop(0), method)))
+            if data:
+                writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                await writer.drain()
+    except Exception as e:
+        # Заголовки уже ушли: ошибка - последней строкой потока, тело завершается как обычно
+        REQUESTS['errors'] += 1
+        for task in pending:
+            task.cancel()
+        data = (json.dumps({'error': repr(e)}, ensure_ascii=False) + "\n").encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+    writer.write(b"0\r\n\r\n")
+    await writer.drain()
+
+async def handle_connection(reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            # Заголовки не нужны, но их надо дочитать до пустой строки
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+
+            REQUESTS['total'] += 1
+            try:
+                verb, target, _ = request_line.decode().split(' ', 2)
+            except ValueError:
+                await write_response(writer, 400, json.dumps({'error': "некорректная строка запроса"}))
+                break
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+            if verb != 'GET':
+                await write_response(writer, 405, json.dumps({'error': "поддерживается только GET"}))
+            elif url.path == '/batch':
+                await stream_batch(writer, query)
+            elif url.path in HANDLERS:
+                try:
+                    await write_response(writer, 200, await run(HANDLERS[url.path], query))
+                except (KeyError, ValueError) as e:
+                    REQUESTS['errors'] += 1
+                    await write_response(writer, 400, json.dumps({'error': str(e)}, ensure_ascii=False))
+                except Exception as e:
+                    REQUESTS['errors'] += 1
+                    await write_response(writer, 500, json.dumps({'error': repr(e)}, ensure_ascii=False))
+            else:
+                await write_response(writer, 404, json.dumps({'error': f"нет пути {url.path}"}, ensure_ascii=False))
+    except (ConnectionResetError, BrokenPipeError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host='127.0.0.1', port=8765, socket_path=None):
+    if socket_path:
+        server = await asyncio.start_unix_server(handle_connection, path=socket_path)
+        print(f"Сервис слушает {socket_path} ({len(core.series_index['offsets'])} рядов)")
+    else:
+        server = await asyncio.start_server(handle_connection, host, port)
+        print(f"Сервис слушает http://{host}:{port} ({len(core.series_index['offsets'])} рядов)")
+    async with server:
+        await server.serve_forever()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Локальный сервис интерполяции TSDS")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="путь Unix сокета вместо TCP")
+    parser.add_argument('--threads', type=int, default=4, help="потоки для лёгких запросов")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="процессы для подгонок")
+    args = parser.parse_args(argv)
+    global EXECUTOR, PROCESSES
+    EXECUTOR = ThreadPoolExecutor(args.threads)
+    PROCESSES = process_pool(args.workers)
+    try:
+        asyncio.run(serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    sys.exit(main())
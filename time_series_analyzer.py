@@ -1,22 +1,20 @@
 # %%
 import polars as pl
 import altair as alt
-from datetime import datetime, timedelta
+
+from data_utils import scan_clean_data
+from outages import load_outages, drop_outages
+from downsample import downsample_frame
 
 alt.data_transformers.disable_max_rows()
 
 # %%
 # Загрузка данных
 raw_df = (
-    pl.scan_csv("data/raw/collected.csv", has_header=False,
-                new_columns=["row", "date", "item_id", "y"])
-    .with_columns([
-        pl.col("date").str.to_datetime(strict=False),
-        pl.col("y").cast(pl.Float64, strict=False),
-    ])
-    .drop("row").drop_nulls()
+    scan_clean_data("data/raw/collected.csv")
+    .rename({"id": "item_id", "value": "y"})
     .sort(["item_id", "date"])
-    .collect()
+    .collect(engine="streaming")
 )
 
 # Ресемплирование по дням (медиана)
@@ -28,28 +26,13 @@ df = (
 )
 
 # %%
-# Захардкоженные системные сбои
-gap_periods = [
-    ('2024-08-01', '2024-08-11'),
-    ('2024-10-15', '2024-10-17'), 
-    ('2024-10-19', '2024-10-20'),
-    ('2024-10-22', '2024-10-24'),
-    ('2025-01-30', '2025-03-19'),
-]
-gap_periods = [(datetime.strptime(s, '%Y-%m-%d'), datetime.strptime(e, '%Y-%m-%d')) 
-               for s, e in gap_periods]
-
-excluded_dates = set()
-for start_gap, end_gap in gap_periods:
-    current_date = start_gap
-    while current_date <= end_gap:
-        excluded_dates.add(current_date)
-        current_date += timedelta(days=1)
+# Календарь системных сбоев
+outages = load_outages("data/outages.csv")
 
 # %%
 # Отбор рядов с минимальным количеством точек
 stats = (
-    df.filter(~pl.col("date").is_in(list(excluded_dates)))
+    drop_outages(df, outages)
     .group_by("item_id")
     .agg([
         pl.col("y").count().alias("n_points")
@@ -98,6 +81,9 @@ def prepare_data(series_ids, batch_size=10):
 
 chart_data = prepare_data(all_series_ids, batch_size=30)
 
+# Прореживание под ширину графика: в спецификацию Altair попадает не больше ~1800 точек на ряд
+chart_data = downsample_frame(chart_data, n_out=1800, by="item_id")
+
 # %%
 # График
 max_group = chart_data['group_num'].max()
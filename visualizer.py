@@ -1,25 +1,38 @@
 import matplotlib.pyplot as plt
 import math
 
-def plot_interpolation(original_data, interpolated_data, method, series_id):
-    plt.figure(figsize=(12, 6))
+from instrument import timed
+from downsample import to_plot_arrays
+
+@timed("plot")
+def plot_interpolation(original_data, interpolated_data, method, series_id, max_points=None, show=True):
+    fig = plt.figure(figsize=(12, 6))
+    # Больше точек, чем пикселей по ширине, на графике всё равно не видно
+    max_points = max_points or int(fig.get_figwidth() * fig.dpi)
     # Исходные данные - тонкая линия
-    plt.plot(original_data["date"].to_list(), original_data["value"].to_list(), "-", 
+    plt.plot(*to_plot_arrays(original_data, max_points), "-", 
              color='darkblue', alpha=1.0, linewidth=1.5, label="Исходные данные")
     # Интерполированные данные - полупрозрачная пастельная линия
-    plt.plot(interpolated_data["date"].to_list(), interpolated_data["value"].to_list(), "-", 
+    plt.plot(*to_plot_arrays(interpolated_data, max_points), "-", 
              color='lightcoral', alpha=0.6, linewidth=4, label=f"{method} интерполяция")
     plt.title(f"Серия {series_id} - {method}")
     plt.legend()
     plt.grid(True, alpha=0.3)
     plt.xticks(rotation=45)
     plt.tight_layout()
-    plt.show()
+    # show=False - фигура возвращается для savefig (закрыть через plt.close)
+    if show:
+        plt.show()
+    return fig
 
-def compare_methods(original_data, results, series_id):
+@timed("plot_compare")
+def compare_methods(original_data, results, series_id, max_points=None, show=True):
     methods = [k for k, v in results.items() if v is not None]
     fig, axes = plt.subplots(2, 2, figsize=(15, 10))
     axes = axes.flatten()
+    # Ширина одного графика в пикселях
+    max_points = max_points or int(fig.get_figwidth() * fig.dpi / 2)
+    original_x, original_y = to_plot_arrays(original_data, max_points)
     
     pastel_colors = ["lightcoral", "lightgreen", "lightsalmon", "plum"]
     
@@ -28,10 +41,10 @@ def compare_methods(original_data, results, series_id):
         ax = axes[i]
         
         # Исходные данные - тонкая линия
-        ax.plot(original_data["date"].to_list(), original_data["value"].to_list(), "-", 
+        ax.plot(original_x, original_y, "-", 
                color='darkblue', alpha=1.0, linewidth=1.5, label="Исходные")
         # Интерполированные данные - полупрозрачная пастельная линия
-        ax.plot(result["date"].to_list(), result["value"].to_list(), "-", 
+        ax.plot(*to_plot_arrays(result, max_points), "-", 
                color=pastel_colors[i], alpha=0.6, linewidth=4, label=method)
         ax.set_title(method)
         ax.legend()
@@ -42,5 +55,8 @@ def compare_methods(original_data, results, series_id):
     
     plt.suptitle(f"Сравнение методов - Серия {series_id}", fontsize=14)
     plt.tight_layout()
-    plt.show()
+    # show=False - фигура возвращается для savefig (закрыть через plt.close)
+    if show:
+        plt.show()
+    return fig
 